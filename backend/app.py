@@ -1,13 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, event
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import attributes
+from sqlalchemy.pool import QueuePool
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from functools import wraps
+import hashlib
 import secrets
+import threading
+import json
+import re
+import time
+import click
+from concurrent.futures import TimeoutError as FutureTimeout
 from dotenv import load_dotenv
 import google.generativeai as genai
+from bulk_import import BulkImport
+from cache import TTLCache
+import directory
+from fake_gemini import FakeGenerativeModel
+from fake_geocoder import LocalGeocoder
+from geo import HospitalLocator, haversine_km
+from load_dump import DumpError, load_file
+from dispatch import Dispatcher, DispatchQueue, eta_minutes
+from live_status import StatusHub
+from passwords import PasswordHasher
+from config import Config, engine_options
+import metrics
+import migrations
+from query_profiler import QueryProfiler
+from replicas import ReplicaRouter, RoutingSession
+from resilience import CircuitBreaker, CircuitOpen, ConcurrencyLimiter, Overloaded, PriorityAdmission, SingleFlight
+from sessions import IdentityCache, ServerSessionInterface, SessionStore, SQLiteStore
 
 load_dotenv()
 
@@ -18,16 +45,68 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'mysql+pymysql://root:Ashok%4011042005@
 if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
+# Optional read replicas (comma-separated URLs) for read-only pages
+REPLICA_URLS = [url.strip().replace('postgres://', 'postgresql://', 1)
+                for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
 app = Flask(__name__, template_folder='../frontend/templates')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', secrets.token_hex(16))
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
+app.config['DB_POOL_WARMUP'] = Config.DB_POOL_WARMUP
+app.config['SQLALCHEMY_BINDS'] = {f'replica{number}': dict(engine_options(url), url=url)
+                                  for number, url in enumerate(REPLICA_URLS, 1)}
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+# Sessions are kept server-side (the cookie holds only an id): in each process, and in SESSION_STORE_PATH,
+# a SQLite file shared by the workers on this host, when set (gunicorn.conf.py sets it)
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', '')
+session_store = SessionStore(
+    maxsize=int(os.getenv('SESSION_CACHE_SIZE', 10000)),
+    shared=SQLiteStore(SESSION_STORE_PATH) if SESSION_STORE_PATH else None,
+    local_ttl=float(os.getenv('SESSION_LOCAL_TTL', 5)))
+app.session_interface = ServerSessionInterface(session_store)
+
+replica_router = ReplicaRouter(
+    names=app.config['SQLALCHEMY_BINDS'],
+    max_lag=float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5)),
+    check_interval=float(os.getenv('REPLICA_CHECK_INTERVAL', 2)),
+    sticky_seconds=float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+)
+
+# Admission control per worker: the last slots are kept for emergency requests and chat/analytics get a
+# capped share. A gevent worker runs many more requests than the pool has connections: cached pages and
+# chat need none, and the rest wait for one in the pool. So by default four requests run per connection
+pool_options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY',
+                                   4 * (pool_options.get('pool_size', 0) + pool_options.get('max_overflow', 0)) or 64))
+admission = PriorityAdmission(
+    capacity=ADMISSION_CAPACITY,
+    reserved=int(os.getenv('ADMISSION_EMERGENCY_RESERVED', max(3, ADMISSION_CAPACITY // 8))),
+    low_limit=int(os.getenv('ADMISSION_LOW_PRIORITY_LIMIT', 4)),
+    max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', 200)),
+    timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10)),
+    emergency_timeout=float(os.getenv('ADMISSION_EMERGENCY_TIMEOUT', 30)))
+# Lanes by endpoint; anything not listed is 'standard'
+EMERGENCY_ENDPOINTS = {'emergency', 'nearest_hospitals_api', 'book_ambulance', 'ambulance_status',
+                       'ambulance_status_stream', 'update_ambulance_position', 'update_ambulance_status'}
+LOW_PRIORITY_ENDPOINTS = {'chat_with_ai', 'chat_with_ai_stream', 'chat_cache_stats', 'sql_profile_report',
+                          'setup_database', 'smart_import_data', 'import_production_data'}
+# Event streams hold their connection for minutes after one quick query; they are bounded by the AI limiter
+# and their own time limits, and never wait behind (or crowd out) requests that need the database
+UNMETERED_ENDPOINTS = {'static', 'prometheus_metrics', 'admission_report', 'chat_with_ai_stream',
+                       'ambulance_status_stream'}
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
-if GEMINI_API_KEY:
+# REST keeps Gemini calls on plain sockets, which gevent workers can multiplex (gRPC would block them)
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT', 'rest')
+if os.getenv('GEMINI_FAKE', '').lower() in ('1', 'true', 'yes'):
+    model = FakeGenerativeModel(latency=float(os.getenv('GEMINI_FAKE_LATENCY', 0)))
+    print("⚠ Using local fake Gemini model")
+elif GEMINI_API_KEY:
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
+        genai.configure(api_key=GEMINI_API_KEY, transport=GEMINI_TRANSPORT)
         model = genai.GenerativeModel('gemini-2.5-flash')
         print("✓ Gemini AI configured successfully")
     except Exception as e:
@@ -39,6 +118,94 @@ else:
 
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY', '')
 
+# Passwords are hashed and checked in the request thread unless PASSWORD_HASH_WORKERS sizes a per-worker
+# process pool (gunicorn.conf.py does, dividing the CPUs between its workers; scripts and `python app.py`
+# stay single-process). Logins beyond the queue get a 503. Hashes made with another method or cost are
+# upgraded on next login
+password_hasher = PasswordHasher(
+    method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'),
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', 0)),
+    max_queue=int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 64)),
+    timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', 10)))
+
+# Hospital coordinates come from a batch geocoder. None is wired up yet: the local stand-in makes up
+# coordinates, so it only runs when asked for, and otherwise new hospitals are left without any
+if os.getenv('GEOCODER_FAKE', '').lower() in ('1', 'true', 'yes'):
+    geocoder = LocalGeocoder(latency=float(os.getenv('GEOCODER_FAKE_LATENCY', 0)))
+    print("⚠ Using local fake geocoder")
+else:
+    geocoder = None
+# Nearest-hospital lookups use a per-process KD-tree rebuilt at most this often
+HOSPITAL_INDEX_TTL = int(os.getenv('HOSPITAL_INDEX_TTL', 300))
+AMBULANCE_DESTINATION_MAX_KM = float(os.getenv('AMBULANCE_DESTINATION_MAX_KM', 100))
+# Ambulance dispatch: the nearest available unit within range; ETA from distance at an average speed
+AMBULANCE_MAX_DISPATCH_KM = float(os.getenv('AMBULANCE_MAX_DISPATCH_KM', 50))
+AMBULANCE_SPEED_KMH = float(os.getenv('AMBULANCE_SPEED_KMH', 35))
+FLEET_REFRESH_SECONDS = float(os.getenv('FLEET_REFRESH_SECONDS', 5))
+# Requests arriving together are stored and assigned in one transaction, up to this many at a time
+DISPATCH_MAX_BATCH = int(os.getenv('DISPATCH_MAX_BATCH', 100))
+DISPATCH_TIMEOUT = float(os.getenv('DISPATCH_TIMEOUT', 10))
+# Booking status is pushed over server-sent events; changes from other workers are polled for this often
+AMBULANCE_STATUS_POLL_SECONDS = float(os.getenv('AMBULANCE_STATUS_POLL_SECONDS', 2))
+AMBULANCE_STATUS_STREAM_SECONDS = int(os.getenv('AMBULANCE_STATUS_STREAM_SECONDS', 300))
+AMBULANCE_STATUS_CACHE_TTL = int(os.getenv('AMBULANCE_STATUS_CACHE_TTL', 5))
+
+# Booking slots are cut from DoctorAvailability windows and precomputed this far ahead
+SLOT_MINUTES = int(os.getenv('SLOT_MINUTES', 30))
+SLOT_HORIZON_DAYS = int(os.getenv('SLOT_HORIZON_DAYS', 30))
+APPOINTMENT_STATUSES = ('pending', 'approved', 'completed', 'rejected', 'cancelled')
+RELEASED_STATUSES = ('rejected', 'cancelled')
+DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', 20))
+DIRECTORY_PAGE_SIZE = int(os.getenv('DIRECTORY_PAGE_SIZE', 20))
+
+# Homepage statistics are served from memory; writes that change them invalidate explicitly
+HOMEPAGE_CACHE_TTL = int(os.getenv('HOMEPAGE_CACHE_TTL', 60))
+homepage_cache = TTLCache(maxsize=1, ttl=HOMEPAGE_CACHE_TTL)
+directory_cache = TTLCache(maxsize=4, ttl=HOMEPAGE_CACHE_TTL)
+
+# Clinic facts for the AI system prompt, rebuilt in the background when stale or invalidated
+CHAT_CONTEXT_TTL = int(os.getenv('CHAT_CONTEXT_TTL', 300))
+chat_context = {'version': None, 'prompt': None, 'built_at': 0.0, 'refreshing': False}
+chat_context_lock = threading.Lock()
+
+# Answers to repeated questions, keyed on the normalized message and the context version
+chat_response_cache = TTLCache(maxsize=int(os.getenv('CHAT_CACHE_SIZE', 512)),
+                               ttl=int(os.getenv('CHAT_CACHE_TTL', 3600)))
+
+# (owner, status) of recently polled ambulance bookings; local commits invalidate them
+ambulance_status_cache = TTLCache(maxsize=10000, ttl=AMBULANCE_STATUS_CACHE_TTL)
+
+# Secret for operator-only endpoints, accepted only in the X-Admin-Secret header; unset disables them
+ADMIN_SECRET = os.getenv('ADMIN_SECRET', '')
+if not ADMIN_SECRET:
+    print("⚠ ADMIN_SECRET not set - admin endpoints are disabled")
+
+# SQL profiling: a sampled share of requests get query counts, DB time and N+1 detection
+query_profiler = QueryProfiler(
+    sample_rate=float(os.getenv('SQL_PROFILE_SAMPLE_RATE', 0.1)),
+    slow_query_ms=float(os.getenv('SQL_SLOW_QUERY_MS', 200)),
+    duplicate_threshold=int(os.getenv('SQL_DUPLICATE_THRESHOLD', 3))
+)
+
+def use_sqlite_wal(dbapi_connection, connection_record):
+    # Readers no longer block the writer, which matters once ambulance dispatch writes under load
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+with app.app_context():
+    for engine in db.engines.values():
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', use_sqlite_wal)
+        query_profiler.install(engine)
+        metrics.instrument_pool(engine.pool)
+        metrics.track_pool_usage(engine)
+# Set to require "Authorization: Bearer <token>" on /metrics
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Ambulance crews' devices report positions and job status with "Authorization: Bearer <token>"
+FLEET_TOKEN = os.getenv('FLEET_TOKEN', '')
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -58,20 +225,29 @@ class User(db.Model):
     appointments = db.relationship('Appointment', backref='patient', lazy=True)
 
 class Hospital(db.Model):
+    __table_args__ = (
+        db.Index('ix_hospital_admin_id', 'admin_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     address = db.Column(db.String(500), nullable=False)
     contact = db.Column(db.String(20))
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     description = db.Column(db.Text)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     doctors = db.relationship('Doctor', backref='hospital', lazy=True)
     appointments = db.relationship('Appointment', backref='hospital', lazy=True)
 
 class Doctor(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_user_id', 'user_id'),
+        db.Index('ix_doctor_hospital_id', 'hospital_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
-    specialization = db.Column(db.String(100), nullable=False)
+    specialization = db.Column(db.String(100), nullable=False, index=True)
     experience = db.Column(db.Integer)
     consultation_fee = db.Column(db.Float, default=50.00)
     about = db.Column(db.Text)
@@ -82,6 +258,9 @@ class Doctor(db.Model):
         return self.user.name if self.user else "Unknown"
 
 class DoctorAvailability(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_availability_doctor_id', 'doctor_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     day_of_week = db.Column(db.Integer, nullable=False)
@@ -89,6 +268,15 @@ class DoctorAvailability(db.Model):
     end_time = db.Column(db.Time, nullable=False)
 
 class Appointment(db.Model):
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_status_time', 'doctor_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_patient_status_time', 'patient_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_hospital_time', 'hospital_id', 'appointment_time'),
+        db.Index('ix_appointment_hospital_status_time', 'hospital_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_status', 'status'),
+        db.Index('ix_appointment_created_at', 'created_at'),
+        db.Index('ix_appointment_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -104,9 +292,84 @@ class Appointment(db.Model):
     test_results = db.Column(db.Text)
     doctor_notes = db.Column(db.Text)
     completed_at = db.Column(db.DateTime)
+    # The doctor's fee when the appointment was booked; rows without one count at the doctor's current fee
+    consultation_fee = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AppointmentSlot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'slot_time', name='uq_appointment_slot_doctor_time'),
+        # Free slots only, per doctor in time order: what booking pages and /api/slots/next range-scan
+        db.Index('ix_appointment_slot_free', 'doctor_id', 'slot_time',
+                 postgresql_where=db.text('appointment_id IS NULL'), sqlite_where=db.text('appointment_id IS NULL')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    slot_time = db.Column(db.DateTime, nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), unique=True)
+
+class AppointmentRollup(db.Model):
+    """Running appointment count and fee total per doctor and status."""
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'doctor_id', 'status', name='uq_appointment_rollup_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+    fee_total = db.Column(db.Float, nullable=False, default=0)
+
+class AppointmentDailyRollup(db.Model):
+    """Running appointment count and fee total per doctor, appointment day and status."""
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'day', 'doctor_id', 'status', name='uq_appointment_daily_rollup_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+    fee_total = db.Column(db.Float, nullable=False, default=0)
+
+class ReplicationHeartbeat(db.Model):
+    """Single row the primary touches so replicas without a native lag query can measure theirs."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class DirectoryEntry(db.Model):
+    """Denormalized search row for one hospital or one doctor, rewritten whenever its sources change.
+
+    No foreign keys: entries are removed after their hospital or doctor, in the same flush.
+    """
+    __table_args__ = (
+        db.Index('ix_directory_entry_kind_name', 'kind', 'name', 'id'),
+        db.Index('ix_directory_entry_kind_specialization_name', 'kind', 'specialization', 'name', 'id'),
+        db.Index('ix_directory_entry_hospital_kind', 'hospital_id', 'kind'),
+        db.Index('ix_directory_entry_doctor_id', 'doctor_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entry_key = db.Column(db.String(20), unique=True, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    hospital_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer)
+    name = db.Column(db.String(200), nullable=False)
+    hospital_name = db.Column(db.String(200))
+    address = db.Column(db.String(500))
+    contact = db.Column(db.String(20))
+    description = db.Column(db.Text)
+    specialization = db.Column(db.String(100))
+    consultation_fee = db.Column(db.Float)
+    experience = db.Column(db.Integer)
+    doctor_count = db.Column(db.Integer)
+    search_text = db.Column(db.Text, nullable=False)
 
 class EmergencyContact(db.Model):
+    __table_args__ = (
+        db.Index('ix_emergency_contact_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -117,7 +380,27 @@ class EmergencyContact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='emergency_contacts')
 
+class Ambulance(db.Model):
+    __table_args__ = (
+        db.Index('ix_ambulance_status', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_number = db.Column(db.String(50), unique=True, nullable=False)
+    driver_name = db.Column(db.String(100))
+    driver_phone = db.Column(db.String(20))
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    status = db.Column(db.String(20), nullable=False, default='available')  # available, dispatched, offline
+    booking_id = db.Column(db.Integer)  # current job while dispatched
+    position_updated_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AmbulanceBooking(db.Model):
+    __table_args__ = (
+        db.Index('ix_ambulance_booking_user_created', 'user_id', 'created_at'),
+        db.Index('ix_ambulance_booking_status_created', 'status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     patient_name = db.Column(db.String(100), nullable=False)
@@ -131,6 +414,7 @@ class AmbulanceBooking(db.Model):
     emergency_type = db.Column(db.String(100))
     patient_condition = db.Column(db.Text)
     status = db.Column(db.String(20), default='requested')
+    ambulance_id = db.Column(db.Integer, db.ForeignKey('ambulance.id'))
     ambulance_number = db.Column(db.String(50))
     driver_name = db.Column(db.String(100))
     driver_phone = db.Column(db.String(20))
@@ -139,10 +423,360 @@ class AmbulanceBooking(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user = db.relationship('User', backref='ambulance_bookings')
 
+ROLLUP_KEY_FIELDS = ('hospital_id', 'doctor_id', 'appointment_time', 'status', 'consultation_fee')
+
+def _rollup_values(appointment, previous=False):
+    values = {}
+    for field in ROLLUP_KEY_FIELDS:
+        history = attributes.get_history(appointment, field)
+        if previous and history.deleted:
+            values[field] = history.deleted[0]
+        elif previous and history.unchanged:
+            values[field] = history.unchanged[0]
+        else:
+            values[field] = getattr(appointment, field)
+    values['status'] = values['status'] or 'pending'
+    return values
+
+def _increment_rollup(connection, model, key, count_delta, fee_delta):
+    table = model.__table__
+    values = dict(key, appointment_count=count_delta, fee_total=fee_delta)
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table).values(**values)
+        stmt = insert.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                'appointment_count': table.c.appointment_count + insert.excluded.appointment_count,
+                'fee_total': table.c.fee_total + insert.excluded.fee_total
+            }
+        )
+    elif dialect == 'mysql':
+        insert = mysql.insert(table).values(**values)
+        stmt = insert.on_duplicate_key_update(
+            appointment_count=table.c.appointment_count + insert.inserted.appointment_count,
+            fee_total=table.c.fee_total + insert.inserted.fee_total
+        )
+    else:
+        result = connection.execute(
+            table.update()
+            .where(*[table.c[column] == value for column, value in key.items()])
+            .values(appointment_count=table.c.appointment_count + count_delta,
+                    fee_total=table.c.fee_total + fee_delta)
+        )
+        if result.rowcount:
+            return
+        stmt = table.insert().values(**values)
+    connection.execute(stmt)
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_appointment_rollups(flush_session, flush_context):
+    """Apply each flushed appointment insert, status/slot change or delete to the rollup tables.
+
+    Runs inside the flush's transaction, so rollups commit or roll back with the change itself.
+    Revenue counts each appointment's own fee, as rebuild_rollups() does.
+    """
+    deltas = []
+    for obj in flush_session.new:
+        if isinstance(obj, Appointment):
+            deltas.append((_rollup_values(obj), 1))
+    for obj in flush_session.deleted:
+        if isinstance(obj, Appointment):
+            deltas.append((_rollup_values(obj, previous=True), -1))
+    for obj in flush_session.dirty:
+        if isinstance(obj, Appointment) and flush_session.is_modified(obj):
+            old, new = _rollup_values(obj, previous=True), _rollup_values(obj)
+            if old != new:
+                deltas.extend([(old, -1), (new, 1)])
+    if not deltas:
+        return
+    connection = flush_session.connection()
+    doctor_ids = {values['doctor_id'] for values, _ in deltas if values['consultation_fee'] is None}
+    fees = dict(connection.execute(
+        db.select(Doctor.id, Doctor.consultation_fee).where(Doctor.id.in_(doctor_ids))
+    ).all()) if doctor_ids else {}
+    for values, sign in deltas:
+        fee = values['consultation_fee']
+        fee = ((fees.get(values['doctor_id']) or 0) if fee is None else fee) * sign
+        key = {'hospital_id': values['hospital_id'], 'doctor_id': values['doctor_id'], 'status': values['status']}
+        _increment_rollup(connection, AppointmentRollup, key, sign, fee)
+        key['day'] = values['appointment_time'].date()
+        _increment_rollup(connection, AppointmentDailyRollup, key, sign, fee)
+
+DIRECTORY_HOSPITAL_FIELDS = ('name', 'address', 'contact')
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_directory(flush_session, flush_context):
+    """Rewrite the directory entries of every hospital, doctor and doctor account this flush touched."""
+    hospital_ids, doctor_ids, staff_hospital_ids, doctor_user_ids = set(), set(), set(), set()
+    changed = [obj for obj in flush_session.dirty if flush_session.is_modified(obj)]
+    for obj in list(flush_session.new) + list(flush_session.deleted) + changed:
+        if isinstance(obj, Hospital):
+            hospital_ids.add(obj.id)
+            # Doctor entries carry the hospital's name and address
+            if obj in flush_session.deleted or any(
+                    attributes.get_history(obj, field).has_changes() for field in DIRECTORY_HOSPITAL_FIELDS):
+                staff_hospital_ids.add(obj.id)
+        elif isinstance(obj, Doctor):
+            doctor_ids.add(obj.id)
+            hospital_id_history = attributes.get_history(obj, 'hospital_id')
+            hospital_ids.update(value for value in hospital_id_history.sum() if value is not None)
+        elif isinstance(obj, User) and obj.user_type == 'doctor' and obj in changed:
+            if attributes.get_history(obj, 'name').has_changes():
+                doctor_user_ids.add(obj.id)
+    if not (hospital_ids or doctor_ids or doctor_user_ids):
+        return
+    connection = flush_session.connection()
+    if doctor_user_ids:
+        doctor_ids.update(connection.execute(
+            db.select(Doctor.id).where(Doctor.user_id.in_(doctor_user_ids))).scalars())
+    directory.refresh(connection, db.metadata.tables, hospital_ids, doctor_ids, staff_hospital_ids)
+
+@event.listens_for(db.session, 'after_flush')
+def track_ambulance_booking_changes(flush_session, flush_context):
+    changed = flush_session.info.setdefault('ambulance_bookings_changed', set())
+    changed.update(obj.id for obj in list(flush_session.new) + list(flush_session.dirty)
+                   if isinstance(obj, AmbulanceBooking))
+
+@event.listens_for(db.session, 'after_commit')
+def publish_ambulance_booking_changes(commit_session):
+    changed = commit_session.info.pop('ambulance_bookings_changed', None)
+    if changed:
+        for booking_id in changed:
+            ambulance_status_cache.invalidate(booking_id)
+        booking_status_hub.notify()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_ambulance_booking_changes(rollback_session):
+    rollback_session.info.pop('ambulance_bookings_changed', None)
+
+def rebuild_rollups():
+    """Recompute the appointment rollup tables from scratch with INSERT ... SELECT aggregates.
+
+    Returns the number of doctor and daily rollup rows written.
+    """
+    status = db.func.coalesce(Appointment.status, 'pending')
+    fee = db.func.coalesce(Appointment.consultation_fee, Doctor.consultation_fee, 0)
+    totals = (db.select(Appointment.hospital_id, Appointment.doctor_id, status,
+                        db.func.count(Appointment.id), db.func.sum(fee))
+        .join(Doctor, Doctor.id == Appointment.doctor_id)
+        .group_by(Appointment.hospital_id, Appointment.doctor_id, status))
+    day = db.func.date(Appointment.appointment_time)
+    daily = (db.select(Appointment.hospital_id, Appointment.doctor_id, day, status,
+                       db.func.count(Appointment.id), db.func.sum(fee))
+        .join(Doctor, Doctor.id == Appointment.doctor_id)
+        .group_by(Appointment.hospital_id, Appointment.doctor_id, day, status))
+    AppointmentDailyRollup.query.delete()
+    AppointmentRollup.query.delete()
+    written = []
+    for model, select, columns in (
+            (AppointmentRollup, totals, ['hospital_id', 'doctor_id', 'status', 'appointment_count', 'fee_total']),
+            (AppointmentDailyRollup, daily, ['hospital_id', 'doctor_id', 'day', 'status', 'appointment_count', 'fee_total'])):
+        result = db.session.execute(db.insert(model).from_select(columns, select))
+        written.append(result.rowcount)
+    db.session.commit()
+    return tuple(written)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the appointment rollup tables from scratch, e.g. after a raw SQL import."""
+    totals, daily = rebuild_rollups()
+    print(f"✓ Rebuilt {totals} doctor rollups and {daily} daily rollups")
+
+def pool_stats():
+    pool = db.engine.pool
+    stats = {'pool_class': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow(), max_overflow=pool._max_overflow, timeout=pool.timeout())
+    return stats
+
+def warm_db_pool():
+    """Open the pool's connections up front (gunicorn calls this as each worker starts),
+    so connection setup happens before traffic arrives rather than inside the first requests."""
+    if not app.config['DB_POOL_WARMUP']:
+        return 0
+    with app.app_context():
+        pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return 0
+        connections = []
+        try:
+            for _ in range(pool.size()):
+                connections.append(db.engine.raw_connection())
+        except Exception as e:
+            print(f"⚠ DB pool warm-up stopped: {e}")
+        finally:
+            for connection in connections:
+                connection.close()
+        return len(connections)
+
+def _refresh_replica_state():
+    with app.app_context():
+        replica_router.refresh(db.engine, {name: db.engines[name] for name in replica_router.names},
+                               ReplicationHeartbeat.__table__)
+    for replica in replica_router.report():
+        if replica['lag_seconds'] is not None:
+            metrics.REPLICA_LAG.labels(replica=replica['name']).set(replica['lag_seconds'])
+        if replica['error']:
+            print(f"Replica check error ({replica['name']}): {replica['error']}")
+
+def choose_replica_engine():
+    """The engine a read-only request should read from, or None for the primary."""
+    if not replica_router.names:
+        return None
+    if replica_router.begin_refresh():
+        threading.Thread(target=_refresh_replica_state, daemon=True).start()
+    if session.get('primary_until', 0) > time.time():
+        # This user wrote moments ago; a replica might not have their change yet
+        metrics.REPLICA_ROUTING.labels(target='primary', reason='read_after_write').inc()
+        return None
+    name = replica_router.choose()
+    if name is None:
+        metrics.REPLICA_ROUTING.labels(target='primary', reason='no_healthy_replica').inc()
+        return None
+    metrics.REPLICA_ROUTING.labels(target=name, reason='read_only').inc()
+    return db.engines[name]
+
+def replica_reads(f):
+    """Serve a read-only view's queries from a healthy replica when one is configured."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.replica_engine = choose_replica_engine()
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.after_request
+def pin_recent_writers_to_primary(response):
+    if g.get('db_wrote') and replica_router.names:
+        session['primary_until'] = time.time() + replica_router.sticky_seconds
+    return response
+
+def is_admin_request():
+    # Never from the query string, where it would end up in access logs and Referer headers
+    supplied = request.headers.get('X-Admin-Secret', '')
+    return bool(ADMIN_SECRET) and bool(supplied) and secrets.compare_digest(supplied, ADMIN_SECRET)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+    metrics.REQUESTS.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    metrics.REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint).observe(
+        time.perf_counter() - g.metrics_started)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if g.pop('metrics_started', None) is not None:
+        metrics.IN_FLIGHT.dec()
+
+def request_lane():
+    if request.endpoint in EMERGENCY_ENDPOINTS:
+        return 'emergency'
+    if request.endpoint in LOW_PRIORITY_ENDPOINTS:
+        return 'low'
+    return 'standard'
+
+@app.before_request
+def admit_request():
+    """Hold back or shed lower-priority requests so emergency requests always find capacity."""
+    if request.endpoint in UNMETERED_ENDPOINTS:
+        return None
+    lane = request_lane()
+    try:
+        queued = admission.acquire(lane)
+    except Overloaded as e:
+        metrics.ADMISSION.labels(lane=lane, outcome='shed').inc()
+        print(f"⚠ Shed {lane} request {request.method} {request.path}: {e}")
+        message = 'Emergency service is busy. Please call 108 directly.' if lane == 'emergency' else \
+            'The server is busy, please try again in a moment.'
+        if request.method == 'GET' and not request.path.startswith('/api/'):
+            response = Response(message, status=503, mimetype='text/plain')
+        else:
+            response = jsonify({'success': False, 'message': message})
+            response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    g.admission_lane = lane
+    metrics.ADMISSION.labels(lane=lane, outcome='queued' if queued else 'admitted').inc()
+    if queued:
+        metrics.ADMISSION_WAIT.labels(lane=lane).observe(time.perf_counter() - g.metrics_started)
+    metrics.LANE_IN_FLIGHT.labels(lane=lane).inc()
+
+def release_admission():
+    lane = g.pop('admission_lane', None)
+    if lane is not None:
+        admission.release(lane)
+        metrics.LANE_IN_FLIGHT.labels(lane=lane).dec()
+        metrics.LANE_LATENCY.labels(lane=lane).observe(time.perf_counter() - g.metrics_started)
+
+@app.after_request
+def release_admission_slot(response):
+    release_admission()
+    return response
+
+@app.teardown_request
+def release_admission_on_error(error=None):
+    release_admission()
+
+@app.before_request
+def start_sql_profile():
+    g.request_started = time.perf_counter()
+    # Operators can force a profile for one request by sending the admin secret
+    query_profiler.start(force=bool(request.headers.get('X-Admin-Secret')) and is_admin_request())
+
+@app.after_request
+def finish_sql_profile(response):
+    profile = query_profiler.stop()
+    if profile is None:
+        return response
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+    summary = profile.summary(query_profiler.duplicate_threshold)
+    response.headers['X-DB-Query-Count'] = str(summary['queries'])
+    response.headers['X-DB-Time-Ms'] = str(summary['db_ms'])
+    response.headers['X-DB-Slowest-Ms'] = str(summary['slowest_ms'])
+    response.headers['X-DB-Duplicate-Statements'] = str(len(summary['duplicates']))
+    print("sql_profile " + json.dumps(dict(
+        route=route, status=response.status_code, request_ms=round(elapsed * 1000, 2), **summary)))
+    query_profiler.record(route, profile, elapsed)
+    return response
+
+@app.teardown_request
+def clear_sql_profile(error=None):
+    query_profiler.stop()
+
+def load_identity(user_id):
+    """The user's id, email, name and type with their doctor and hospital ids, in one query."""
+    doctor_id = db.select(db.func.min(Doctor.id)).where(Doctor.user_id == User.id).scalar_subquery()
+    hospital_id = db.select(db.func.min(Hospital.id)).where(Hospital.admin_id == User.id).scalar_subquery()
+    row = db.session.execute(db.select(User.id, User.email, User.name, User.user_type, doctor_id, hospital_id)
+                             .where(User.id == user_id)).first()
+    if row is None:
+        return None
+    return dict(zip(('id', 'email', 'name', 'user_type', 'doctor_id', 'hospital_id'), row))
+
+# Changes to a user or their profiles call identities.forget(); the TTL covers changes made elsewhere
+identities = IdentityCache(session_store, load_identity, ttl=int(os.getenv('IDENTITY_CACHE_TTL', 300)))
+
+def current_user():
+    """The logged-in user's identity (see load_identity), or None; resolved at most once per request."""
+    if 'identity' not in g:
+        user_id = session.get('user_id')
+        g.identity = identities.get(user_id) if user_id is not None else None
+    return g.identity
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if current_user() is None:
+            # Also ends sessions whose account has been deleted
+            session.clear()
             flash('Please log in first.', 'warning')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
@@ -152,38 +786,568 @@ def role_required(allowed_roles):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'user_type' not in session or session['user_type'] not in allowed_roles:
+            user = current_user()
+            if user is None or user['user_type'] not in allowed_roles:
                 flash('You do not have permission to access this page.', 'danger')
                 return redirect(url_for('index'))
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def slot_times_for_day(windows, day):
+    """Slot start times on ``day`` for availability windows (day_of_week uses Monday=0)."""
+    step = timedelta(minutes=SLOT_MINUTES)
+    times = []
+    for window in windows:
+        if window.day_of_week != day.weekday():
+            continue
+        current = datetime.combine(day, window.start_time)
+        end = datetime.combine(day, window.end_time)
+        while current + step <= end:
+            times.append(current)
+            current += step
+    return sorted(set(times))
+
+def generate_slots(connection, doctor_id, start_date=None, days=SLOT_HORIZON_DAYS, prune=False):
+    """Insert a doctor's missing slots over the booking horizon on ``connection``. Returns the number created.
+
+    With ``prune``, free slots that no availability window covers any more are deleted too, and a
+    doctor left without windows loses all free slots in the range.
+    """
+    windows = connection.execute(
+        db.select(DoctorAvailability.day_of_week, DoctorAvailability.start_time, DoctorAvailability.end_time)
+        .where(DoctorAvailability.doctor_id == doctor_id)).all()
+    if not windows and not prune:
+        return 0
+    start_date = start_date or datetime.now().date()
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = range_start + timedelta(days=days)
+    existing = dict(connection.execute(db.select(AppointmentSlot.slot_time, AppointmentSlot.appointment_id).where(
+        AppointmentSlot.doctor_id == doctor_id,
+        AppointmentSlot.slot_time >= range_start,
+        AppointmentSlot.slot_time < range_end
+    )).all())
+    wanted = [slot_time for offset in range(days)
+              for slot_time in slot_times_for_day(windows, start_date + timedelta(days=offset))]
+    if prune:
+        stale = set(slot_time for slot_time, appointment_id in existing.items() if appointment_id is None) - set(wanted)
+        if stale:
+            connection.execute(db.delete(AppointmentSlot).where(
+                AppointmentSlot.doctor_id == doctor_id,
+                AppointmentSlot.slot_time.in_(stale),
+                AppointmentSlot.appointment_id.is_(None)))
+    wanted = [slot_time for slot_time in wanted if slot_time not in existing]
+    if not wanted:
+        return 0
+    # Appointments made before their slot existed (imports, dumps, older bookings) take it at once
+    booked = {}
+    for appointment_id, appointment_time in connection.execute(db.select(Appointment.id, Appointment.appointment_time)
+            .outerjoin(AppointmentSlot, AppointmentSlot.appointment_id == Appointment.id)
+            .where(
+                Appointment.doctor_id == doctor_id,
+                Appointment.status.notin_(RELEASED_STATUSES),
+                Appointment.appointment_time >= range_start,
+                Appointment.appointment_time < range_end,
+                AppointmentSlot.id.is_(None)
+            ).order_by(Appointment.id)):
+        booked.setdefault(appointment_time, appointment_id)
+    connection.execute(db.insert(AppointmentSlot), [
+        {'doctor_id': doctor_id, 'slot_time': slot_time, 'appointment_id': booked.get(slot_time)}
+        for slot_time in wanted])
+    return len(wanted)
+
+def ensure_doctor_slots(doctor_id, start_date=None, days=SLOT_HORIZON_DAYS):
+    """Precompute missing slots for a doctor over the booking horizon. Returns the number created."""
+    try:
+        created = generate_slots(db.session.connection(), doctor_id, start_date, days)
+        db.session.commit()
+    except IntegrityError:
+        # Another worker generated the same slots first
+        db.session.rollback()
+        return 0
+    return created
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_doctor_slots(flush_session, flush_context):
+    """Regenerate the slots of every doctor whose availability windows this flush added, changed or removed."""
+    changed = [obj for obj in flush_session.dirty if flush_session.is_modified(obj)]
+    doctor_ids = set()
+    for obj in list(flush_session.new) + list(flush_session.deleted) + changed:
+        if isinstance(obj, DoctorAvailability):
+            doctor_ids.update(value for value in attributes.get_history(obj, 'doctor_id').sum() if value is not None)
+    for doctor_id in doctor_ids:
+        generate_slots(flush_session.connection(), doctor_id, prune=True)
+
+def attach_booked_appointments():
+    """Give upcoming appointments that hold no slot the slot at their doctor and time.
+
+    Slots that already exist are taken when free (the lowest appointment id wins a time booked
+    twice); doctors without availability windows get ad-hoc slot rows, as ``claim_slot`` creates.
+    Slots generated later pick up their appointments in ``ensure_doctor_slots``. Returns the number
+    of appointments attached.
+    """
+    now = datetime.now()
+    slot = AppointmentSlot.__table__
+    appointment = Appointment.__table__
+    # Aliased so that it does not correlate with the slot table being updated
+    held = slot.alias('held_slot')
+    unslotted = db.and_(
+        appointment.c.status.notin_(RELEASED_STATUSES),
+        appointment.c.appointment_time >= now,
+        ~db.exists().where(held.c.appointment_id == appointment.c.id)
+    )
+    holder = (db.select(db.func.min(appointment.c.id))
+        .where(
+            appointment.c.doctor_id == slot.c.doctor_id,
+            appointment.c.appointment_time == slot.c.slot_time,
+            unslotted
+        ).scalar_subquery())
+    attached = db.session.execute(
+        db.update(slot)
+        .where(
+            slot.c.appointment_id.is_(None),
+            db.tuple_(slot.c.doctor_id, slot.c.slot_time).in_(
+                db.select(appointment.c.doctor_id, appointment.c.appointment_time).where(unslotted))
+        )
+        .values(appointment_id=holder)
+    ).rowcount
+    ad_hoc = (db.select(appointment.c.doctor_id, appointment.c.appointment_time, db.func.min(appointment.c.id))
+        .where(
+            unslotted,
+            ~db.exists().where(DoctorAvailability.doctor_id == appointment.c.doctor_id),
+            ~db.exists().where(held.c.doctor_id == appointment.c.doctor_id,
+                               held.c.slot_time == appointment.c.appointment_time)
+        ).group_by(appointment.c.doctor_id, appointment.c.appointment_time))
+    attached += db.session.execute(
+        db.insert(slot).from_select(['doctor_id', 'slot_time', 'appointment_id'], ad_hoc)
+    ).rowcount
+    db.session.commit()
+    return attached
+
+def free_slots(doctor_id, start, end):
+    return (AppointmentSlot.query
+        .filter(
+            AppointmentSlot.doctor_id == doctor_id,
+            AppointmentSlot.appointment_id.is_(None),
+            AppointmentSlot.slot_time >= start,
+            AppointmentSlot.slot_time < end
+        ).order_by(AppointmentSlot.slot_time).all())
+
+def claim_slot(doctor_id, slot_time, appointment_id):
+    """Atomically attach an appointment to the doctor's slot at ``slot_time``.
+
+    The conditional UPDATE only matches a slot that is still free, so of two concurrent
+    bookings exactly one sees a row count of 1. Doctors without availability windows get
+    an ad-hoc slot row instead, and the (doctor_id, slot_time) unique constraint rejects
+    whichever insert loses the race.
+    """
+    result = db.session.execute(
+        db.update(AppointmentSlot)
+        .where(
+            AppointmentSlot.doctor_id == doctor_id,
+            AppointmentSlot.slot_time == slot_time,
+            AppointmentSlot.appointment_id.is_(None)
+        ).values(appointment_id=appointment_id)
+    )
+    if result.rowcount == 1:
+        return True
+    if DoctorAvailability.query.filter_by(doctor_id=doctor_id).first():
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.add(AppointmentSlot(doctor_id=doctor_id, slot_time=slot_time, appointment_id=appointment_id))
+        return True
+    except IntegrityError:
+        return False
+
+def release_slot(appointment_id):
+    db.session.execute(
+        db.update(AppointmentSlot)
+        .where(AppointmentSlot.appointment_id == appointment_id)
+        .values(appointment_id=None)
+    )
+
+def encode_cursor(value, row_id):
+    return f"{value.isoformat() if isinstance(value, datetime) else value}|{row_id}"
+
+def decode_cursor(cursor, parse=datetime.fromisoformat):
+    try:
+        value, row_id = cursor.rsplit('|', 1)
+        return parse(value), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_page(query, column, id_column, cursor, page_size, descending=False, parse=datetime.fromisoformat):
+    """Fetch the page of ``query`` that follows ``cursor`` in (column, id) order.
+
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page. Seeking
+    past the cursor keeps every page an index range scan, however deep the history.
+    """
+    position = decode_cursor(cursor, parse) if cursor else None
+    if position:
+        value, row_id = position
+        if descending:
+            query = query.filter(db.or_(column < value, db.and_(column == value, id_column < row_id)))
+        else:
+            query = query.filter(db.or_(column > value, db.and_(column == value, id_column > row_id)))
+    order = (column.desc(), id_column.desc()) if descending else (column, id_column)
+    rows = query.order_by(*order).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(getattr(rows[-1], column.key), getattr(rows[-1], id_column.key))
+    return rows, next_cursor
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations (tables and indexes)."""
+    applied = migrations.upgrade(db.engine, db.metadata)
+    print(f"✓ Applied migrations: {applied}" if applied else "✓ Schema is up to date")
+
+@app.cli.command('rebuild-directory')
+def rebuild_directory_command():
+    """Recreate the hospital/doctor search directory, e.g. after a raw SQL import."""
+    with db.engine.begin() as connection:
+        directory.setup_full_text(connection)
+        count = directory.rebuild(connection, db.metadata.tables)
+    print(f"✓ Rebuilt {count} directory entries")
+
+@app.cli.command('geocode-hospitals')
+@click.option('--batch-size', default=100, show_default=True)
+@click.option('--all', 'regeocode', is_flag=True, help='Geocode hospitals that already have coordinates too')
+def geocode_hospitals_command(batch_size, regeocode):
+    """Backfill hospital latitude/longitude from their addresses in geocoder-sized batches."""
+    if geocoder is None:
+        print("✗ No geocoder configured (set GEOCODER_FAKE=1 for the local stand-in)")
+        return
+    batch_size = min(batch_size, geocoder.max_batch)
+    located = failed = 0
+    last_id = 0
+    while True:
+        query = db.session.query(Hospital.id, Hospital.address).filter(Hospital.id > last_id)
+        if not regeocode:
+            query = query.filter(Hospital.latitude.is_(None))
+        batch = query.order_by(Hospital.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        results = geocoder.geocode_batch([row.address for row in batch])
+        updates = [{'hospital_id': row.id, 'lat': point[0], 'lng': point[1]}
+                   for row, point in zip(batch, results) if point is not None]
+        if updates:
+            table = Hospital.__table__
+            db.session.execute(table.update().where(table.c.id == db.bindparam('hospital_id')).values(
+                latitude=db.bindparam('lat'), longitude=db.bindparam('lng')), updates)
+            db.session.commit()
+        located += len(updates)
+        failed += len(batch) - len(updates)
+    hospital_locator.invalidate()
+    print(f"✓ Geocoded {located} hospitals" + (f", ⚠ {failed} addresses not found" if failed else ''))
+
+@app.cli.command('bulk-import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per executemany batch')
+@click.option('--hash-workers', type=int, help='Processes for hashing plaintext passwords (default: one per CPU)')
+@click.option('--no-geocode', is_flag=True, help='Leave new hospitals without coordinates (see geocode-hospitals)')
+def bulk_import_command(path, batch_size, hash_workers, no_geocode):
+    """Upsert users, hospitals and doctors from a smart-import JSON file in one transaction."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    # Accept the smart-import request body as is
+    data = data.get('data', data)
+    # A pool of its own: the import may use every CPU and has nobody waiting behind it
+    hasher = PasswordHasher(password_hasher.method, workers=hash_workers or os.cpu_count() or 1, timeout=None)
+    try:
+        with db.engine.begin() as connection:
+            result = BulkImport(connection, db.metadata.tables, batch_size=batch_size, hasher=hasher,
+                                geocoder=None if no_geocode else geocoder).run(data)
+    finally:
+        hasher.shutdown()
+    invalidate_clinic_structure()
+    if result['relocated']:
+        hospital_locator.invalidate()
+    # Reaches running workers through SESSION_STORE_PATH when it is set here too; otherwise within IDENTITY_CACHE_TTL
+    identities.forget()
+
+@app.cli.command('add-ambulance')
+@click.argument('vehicle_number')
+@click.option('--hospital-id', type=int, help='Base hospital; the unit starts at its coordinates')
+@click.option('--driver-name')
+@click.option('--driver-phone')
+def add_ambulance_command(vehicle_number, hospital_id, driver_name, driver_phone):
+    """Register an ambulance with the dispatcher."""
+    hospital = Hospital.query.get(hospital_id) if hospital_id else None
+    unit = Ambulance(vehicle_number=vehicle_number, hospital_id=hospital_id, driver_name=driver_name,
+                     driver_phone=driver_phone, latitude=hospital.latitude if hospital else None,
+                     longitude=hospital.longitude if hospital else None)
+    db.session.add(unit)
+    db.session.commit()
+    print(f"✓ Added ambulance {vehicle_number} (id {unit.id})" +
+          ('' if unit.latitude is not None else "; ⚠ no position until its crew reports one"))
+
+@app.cli.command('dispatch-pending')
+@click.option('--limit', default=100, show_default=True)
+def dispatch_pending_command(limit):
+    """Assign ambulances to bookings still waiting for one (e.g. from cron)."""
+    print(f"✓ Dispatched {dispatch_pending(limit)} waiting bookings")
+
+@app.cli.command('generate-slots')
+def generate_slots_command():
+    """Precompute booking slots for every doctor over the booking horizon."""
+    total = 0
+    for (doctor_id,) in db.session.query(Doctor.id).all():
+        total += ensure_doctor_slots(doctor_id)
+    print(f"✓ Generated {total} slots")
+
+@app.cli.command('attach-slots')
+def attach_slots_command():
+    """One-off: attach existing pending and approved appointments to their booking slots."""
+    total = 0
+    for (doctor_id,) in db.session.query(Doctor.id).all():
+        total += ensure_doctor_slots(doctor_id)
+    print(f"✓ Generated {total} slots")
+    print(f"✓ Attached {attach_booked_appointments()} appointments to their slots")
+
+def homepage_stats():
+    now = datetime.now()
+    month_start = datetime(now.year, now.month, 1)
+    next_month_start = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    hospitals = db.session.query(Hospital.id, Hospital.name, Hospital.address, Hospital.description).all()
+    return {
+        'hospitals': [hospital._asdict() for hospital in hospitals],
+        'total_doctors': Doctor.query.count(),
+        'total_hospitals': len(hospitals),
+        'total_appointments': Appointment.query.count(),
+        # A plain range on created_at can use an index, unlike EXTRACT(month ...)
+        'monthly_appointments': Appointment.query.filter(
+            Appointment.created_at >= month_start,
+            Appointment.created_at < next_month_start
+        ).count()
+    }
+
+def directory_search(kind, text=None, specialization=None, min_fee=None, max_fee=None, hospital_id=None,
+                     cursor=None, page_size=DIRECTORY_PAGE_SIZE):
+    """One keyset page of hospital or doctor directory entries, ordered by name.
+
+    Returns ``(entries, next_cursor)``. For hospitals, ``specialization`` keeps those with at
+    least one doctor of that specialization; fee filters apply to doctors only.
+    """
+    query = DirectoryEntry.query.filter(DirectoryEntry.kind == kind)
+    match = directory.match_clause(db.engine.dialect.name, DirectoryEntry.__table__, text)
+    if match is not None:
+        query = query.filter(match)
+    if hospital_id:
+        query = query.filter(DirectoryEntry.hospital_id == hospital_id)
+    if specialization and kind == 'doctor':
+        query = query.filter(DirectoryEntry.specialization == specialization)
+    elif specialization:
+        staff = db.aliased(DirectoryEntry)
+        query = query.filter(db.session.query(staff.id).filter(
+            staff.kind == 'doctor',
+            staff.hospital_id == DirectoryEntry.hospital_id,
+            staff.specialization == specialization
+        ).exists())
+    if kind == 'doctor' and min_fee is not None:
+        query = query.filter(DirectoryEntry.consultation_fee >= min_fee)
+    if kind == 'doctor' and max_fee is not None:
+        query = query.filter(DirectoryEntry.consultation_fee <= max_fee)
+    return keyset_page(query, DirectoryEntry.name, DirectoryEntry.id, cursor, page_size, parse=str)
+
+def directory_specializations():
+    return directory_cache.get_or_set('specializations', lambda: [row[0] for row in db.session.query(
+        DirectoryEntry.specialization).filter(DirectoryEntry.kind == 'doctor').distinct().order_by(
+        DirectoryEntry.specialization)])
+
+def directory_filters():
+    """Directory filters from the query string; fees that are not numbers are ignored."""
+    return {
+        'text': request.args.get('q', '').strip() or None,
+        'specialization': request.args.get('specialization', '').strip() or None,
+        'min_fee': request.args.get('min_fee', type=float),
+        'max_fee': request.args.get('max_fee', type=float),
+        'hospital_id': request.args.get('hospital_id', type=int),
+        'cursor': request.args.get('cursor') or None
+    }
+
+def directory_entry_json(entry):
+    data = {'id': entry.doctor_id if entry.kind == 'doctor' else entry.hospital_id, 'name': entry.name,
+            'hospital_id': entry.hospital_id, 'hospital_name': entry.hospital_name,
+            'address': entry.address, 'contact': entry.contact}
+    if entry.kind == 'doctor':
+        data.update(specialization=entry.specialization, consultation_fee=entry.consultation_fee,
+                    experience=entry.experience, book_url=url_for('book_appointment', doctor_id=entry.doctor_id))
+    else:
+        data.update(doctor_count=entry.doctor_count, description=entry.description,
+                    url=url_for('hospital_details', hospital_id=entry.hospital_id))
+    return data
+
+def optional_float(value):
+    """Float from a form field; blank or malformed values (e.g. no browser location) become None."""
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+def hospital_points():
+    # Its own app context: rebuilds run in a background thread
+    with app.app_context():
+        return db.session.query(Hospital.id, Hospital.latitude, Hospital.longitude).filter(
+            Hospital.latitude.isnot(None), Hospital.longitude.isnot(None)).all()
+
+hospital_locator = HospitalLocator(hospital_points, max_age=HOSPITAL_INDEX_TTL)
+
+def locate_hospital(hospital):
+    """Fill in a new hospital's coordinates; geocode-hospitals retries the ones that fail here."""
+    if geocoder is None:
+        return
+    try:
+        point = geocoder.geocode_batch([hospital.address])[0]
+    except Exception as e:
+        print(f"⚠ Geocoding failed for {hospital.address!r}: {e}")
+        return
+    if point is not None:
+        hospital.latitude, hospital.longitude = point
+
+def nearest_hospitals(lat, lng, k=5, max_km=None):
+    """The ``k`` closest geocoded hospitals as ``(hospital, distance_km)``, closest first."""
+    nearest = hospital_locator.nearest(lat, lng, k, max_km)
+    if not nearest:
+        return []
+    hospitals = {hospital.id: hospital for hospital in
+                 Hospital.query.filter(Hospital.id.in_([hospital_id for hospital_id, _ in nearest]))}
+    # Skip hospitals deleted since the index was built
+    return [(hospitals[hospital_id], distance) for hospital_id, distance in nearest if hospital_id in hospitals]
+
+def available_ambulances():
+    return db.session.query(Ambulance.id, Ambulance.latitude, Ambulance.longitude).filter(
+        Ambulance.status == 'available', Ambulance.latitude.isnot(None), Ambulance.longitude.isnot(None)).all()
+
+dispatcher = Dispatcher(available_ambulances, refresh_seconds=FLEET_REFRESH_SECONDS)
+
+def dispatch_ambulance(booking):
+    """Assign the nearest available ambulance to a requested booking. Returns the unit's row or None.
+
+    The claim joins the caller's transaction, so a new booking and its assignment commit together;
+    the caller commits (or rolls back, which also releases the unit).
+    """
+    if booking.pickup_lat is None or booking.pickup_lng is None:
+        metrics.AMBULANCE_DISPATCH.labels(outcome='no_location').inc()
+        return None
+    started = time.perf_counter()
+    if booking.id is None:
+        db.session.flush()
+    table = Ambulance.__table__
+    unit_columns = (table.c.id, table.c.vehicle_number, table.c.driver_name, table.c.driver_phone)
+    units = {}
+
+    def claim(unit_id):
+        # Only succeeds while the unit is still available, whoever else is dispatching
+        statement = table.update().where(table.c.id == unit_id, table.c.status == 'available').values(
+            status='dispatched', booking_id=booking.id, updated_at=datetime.utcnow())
+        if db.engine.dialect.update_returning:
+            units[unit_id] = db.session.execute(statement.returning(*unit_columns)).first()
+            return units[unit_id] is not None
+        return db.session.execute(statement).rowcount == 1
+
+    try:
+        assigned = dispatcher.assign(booking.pickup_lat, booking.pickup_lng, claim, AMBULANCE_MAX_DISPATCH_KM)
+        if assigned is None:
+            metrics.AMBULANCE_DISPATCH.labels(outcome='no_unit').inc()
+            return None
+        unit_id, distance = assigned
+        unit = units.get(unit_id) or db.session.execute(db.select(*unit_columns).where(table.c.id == unit_id)).first()
+        booking.ambulance_id = unit.id
+        booking.ambulance_number = unit.vehicle_number
+        booking.driver_name = unit.driver_name
+        booking.driver_phone = unit.driver_phone
+        booking.estimated_arrival = datetime.utcnow() + timedelta(minutes=eta_minutes(distance, AMBULANCE_SPEED_KMH))
+        booking.status = 'dispatched'
+        metrics.AMBULANCE_DISPATCH.labels(outcome='assigned').inc()
+        return unit
+    except Exception:
+        metrics.AMBULANCE_DISPATCH.labels(outcome='error').inc()
+        raise
+    finally:
+        metrics.DISPATCH_LATENCY.observe(time.perf_counter() - started)
+
+def ambulance_booking_json(booking):
+    return {
+        'booking_id': booking.id,
+        'status': booking.status,
+        'ambulance_number': booking.ambulance_number,
+        'driver_name': booking.driver_name,
+        'driver_phone': booking.driver_phone,
+        'estimated_arrival': booking.estimated_arrival.isoformat() if booking.estimated_arrival else None,
+        'destination_hospital': booking.destination_hospital
+    }
+
+def store_and_dispatch(requests):
+    """Store a batch of ambulance requests and assign each the nearest free unit, in one transaction."""
+    with app.app_context():
+        bookings = [AmbulanceBooking(**fields) for fields in requests]
+        db.session.add_all(bookings)
+        try:
+            for booking in bookings:
+                dispatch_ambulance(booking)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return [ambulance_booking_json(booking) for booking in bookings]
+
+ambulance_dispatch_queue = DispatchQueue(store_and_dispatch, max_batch=DISPATCH_MAX_BATCH)
+
+def load_booking_states(booking_ids):
+    with app.app_context():
+        rows = db.session.query(
+            AmbulanceBooking.id, AmbulanceBooking.status, AmbulanceBooking.ambulance_number,
+            AmbulanceBooking.driver_name, AmbulanceBooking.driver_phone, AmbulanceBooking.estimated_arrival,
+            AmbulanceBooking.destination_hospital
+        ).filter(AmbulanceBooking.id.in_(booking_ids)).all()
+        return {row.id: ambulance_booking_json(row) for row in rows}
+
+booking_status_hub = StatusHub(load_booking_states, interval=AMBULANCE_STATUS_POLL_SECONDS)
+
+def dispatch_pending(limit=20):
+    """Retry bookings still waiting for a unit, oldest first. Returns how many got one."""
+    waiting = AmbulanceBooking.query.filter(
+        AmbulanceBooking.status == 'requested', AmbulanceBooking.pickup_lat.isnot(None),
+        AmbulanceBooking.pickup_lng.isnot(None)
+    ).order_by(AmbulanceBooking.created_at).limit(limit).all()
+    assigned = 0
+    for booking in waiting:
+        try:
+            unit = dispatch_ambulance(booking)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if unit is not None:
+            assigned += 1
+        elif not len(dispatcher.index):
+            break
+    return assigned
+
+def warm_hospital_index():
+    """Build the nearest-hospital index before traffic arrives (gunicorn calls this per worker)."""
+    with app.app_context():
+        try:
+            return len(hospital_locator.current())
+        except Exception as e:
+            print(f"⚠ Hospital index warm-up failed: {e}")
+            return 0
+
+def invalidate_clinic_structure():
+    """After hospital or doctor changes: drop the homepage and directory caches, mark the chat context stale."""
+    homepage_cache.invalidate()
+    directory_cache.invalidate()
+    with chat_context_lock:
+        chat_context['built_at'] = 0.0
+
 @app.route('/')
 def index():
     try:
-        hospitals = Hospital.query.all()
-        
-        # Get real counts from database
-        total_doctors = Doctor.query.count()
-        total_hospitals = Hospital.query.count()
-        total_appointments = Appointment.query.count()
-        
-        # Get monthly appointments (current month)
-        from datetime import datetime
-        current_month = datetime.now().month
-        current_year = datetime.now().year
-        monthly_appointments = Appointment.query.filter(
-            db.extract('month', Appointment.created_at) == current_month,
-            db.extract('year', Appointment.created_at) == current_year
-        ).count()
-        
-        return render_template('index.html', 
-                             hospitals=hospitals,
-                             total_doctors=total_doctors,
-                             total_hospitals=total_hospitals,
-                             total_appointments=total_appointments,
-                             monthly_appointments=monthly_appointments)
+        return render_template('index.html', **homepage_cache.get_or_set('stats', homepage_stats))
     except Exception as e:
         # Database not initialized - show setup message
         return f"""
@@ -249,10 +1413,21 @@ def login():
             flash('Please provide both email and password', 'danger')
             return render_template('login.html', user_type=user_type)
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid, new_hash = password_hasher.verify_and_update(user.password_hash, password) if user else (False, None)
+        except Overloaded as e:
+            print(f"⚠ Login for {email} turned away: {e}")
+            flash('The server is busy, please try again in a moment.', 'warning')
+            return render_template('login.html', user_type=user_type, next=next_url), 503
+        if valid:
             if user.user_type != user_type:
                 flash(f'This login is for {user_type}s only. Please use the correct login page.', 'danger')
                 return render_template('login.html', user_type=user_type)
+            if new_hash:
+                user.password_hash = new_hash
+                db.session.commit()
+            # Logging in again picks up any change the identity cache has not seen
+            identities.forget(user.id)
             session.clear()
             session['user_id'] = user.id
             session['user_type'] = user.user_type
@@ -280,9 +1455,15 @@ def register():
         if User.query.filter_by(email=email).first():
             flash('Email already registered', 'danger')
             return redirect(url_for('register'))
+        try:
+            password_hash = password_hasher.hash(password)
+        except Overloaded as e:
+            print(f"⚠ Registration for {email} turned away: {e}")
+            flash('The server is busy, please try again in a moment.', 'warning')
+            return redirect(url_for('register'))
         user = User(
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=password_hash,
             name=name,
             user_type=user_type,
             phone=phone,
@@ -304,8 +1485,10 @@ def register():
                 admin_id=user.id,
                 description=request.form.get('hospital_description', '')
             )
+            locate_hospital(hospital)
             db.session.add(hospital)
             db.session.commit()
+            invalidate_clinic_structure()
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -316,14 +1499,53 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/hospitals')
+@replica_reads
 def list_hospitals():
-    hospitals = Hospital.query.all()
-    return render_template('hospitals.html', hospitals=hospitals)
+    filters = directory_filters()
+    hospitals, next_cursor = directory_search('hospital', text=filters['text'],
+                                              specialization=filters['specialization'], cursor=filters['cursor'])
+    return render_template('hospitals.html', hospitals=hospitals, next_cursor=next_cursor, filters=filters,
+                           specializations=directory_specializations())
 
 @app.route('/emergency')
+@replica_reads
 def emergency():
-    hospitals = Hospital.query.all()
-    return render_template('emergency.html', hospitals=hospitals, google_maps_key=GOOGLE_MAPS_API_KEY)
+    hospitals, next_cursor = directory_search('hospital')
+    return render_template('emergency.html', hospitals=hospitals, more_hospitals=next_cursor is not None,
+                           google_maps_key=GOOGLE_MAPS_API_KEY)
+
+@app.route('/api/directory/<kind>')
+@replica_reads
+def directory_api(kind):
+    """Search hospitals or doctors by name, address and specialization, with fee range and keyset paging."""
+    if kind not in ('hospitals', 'doctors'):
+        return jsonify({'success': False, 'message': 'Unknown directory'}), 404
+    filters = directory_filters()
+    limit = max(1, min(request.args.get('limit', DIRECTORY_PAGE_SIZE, type=int), 100))
+    entries, next_cursor = directory_search(kind[:-1], page_size=limit, **filters)
+    return jsonify({
+        'success': True,
+        'results': [directory_entry_json(entry) for entry in entries],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/hospitals/nearest')
+@replica_reads
+def nearest_hospitals_api():
+    """Registered hospitals closest to ``lat``/``lng``, with their distance in km."""
+    lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'success': False, 'message': 'Valid lat and lng are required'}), 400
+    k = max(1, min(request.args.get('k', 5, type=int), 50))
+    max_km = request.args.get('max_km', type=float)
+    return jsonify({
+        'success': True,
+        'hospitals': [{
+            'id': hospital.id, 'name': hospital.name, 'address': hospital.address, 'contact': hospital.contact,
+            'latitude': hospital.latitude, 'longitude': hospital.longitude,
+            'distance_km': round(distance, 2), 'url': url_for('hospital_details', hospital_id=hospital.id)
+        } for hospital, distance in nearest_hospitals(lat, lng, k, max_km)]
+    })
 
 @app.route('/location-test')
 def location_test():
@@ -349,8 +1571,13 @@ def register_hospital():
                 description=description,
                 admin_id=session['user_id']
             )
+            locate_hospital(hospital)
             db.session.add(hospital)
             db.session.commit()
+            invalidate_clinic_structure()
+            if hospital.latitude is not None:
+                hospital_locator.invalidate()
+            identities.forget(session['user_id'])
             flash('Hospital registered successfully!', 'success')
             return redirect(url_for('hospital_dashboard'))
         except Exception as e:
@@ -377,7 +1604,7 @@ def add_doctor_to_hospital(hospital_id):
             doctor_user = User(
                 name=request.form['name'],
                 email=email,
-                password_hash=generate_password_hash(request.form['password']),
+                password_hash=password_hasher.hash(request.form['password']),
                 user_type='doctor'
             )
             db.session.add(doctor_user)
@@ -392,6 +1619,7 @@ def add_doctor_to_hospital(hospital_id):
             )
             db.session.add(doctor)
             db.session.commit()
+            invalidate_clinic_structure()
             flash(f'Doctor {doctor_user.name} added successfully!', 'success')
             return redirect(url_for('hospital_dashboard'))
         except ValueError as e:
@@ -407,12 +1635,12 @@ def add_doctor_to_hospital(hospital_id):
 @app.route('/add_doctor', methods=['POST'])
 @login_required
 def add_doctor():
-    if session.get('user_type') != 'hospital_admin':
+    user = current_user()
+    if user['user_type'] != 'hospital_admin':
         flash('Only hospitals can add doctors', 'danger')
         return redirect(url_for('index'))
     try:
-        hospital = Hospital.query.filter_by(admin_id=session.get('user_id')).first()
-        if not hospital:
+        if not user['hospital_id']:
             flash('Hospital not found', 'danger')
             return redirect(url_for('index'))
         email = request.form['email']
@@ -423,14 +1651,14 @@ def add_doctor():
         doctor_user = User(
             name=request.form['name'],
             email=email,
-            password_hash=generate_password_hash(request.form['password']),
+            password_hash=password_hasher.hash(request.form['password']),
             user_type='doctor'
         )
         db.session.add(doctor_user)
         db.session.flush()
         doctor = Doctor(
             user_id=doctor_user.id,
-            hospital_id=hospital.id,
+            hospital_id=user['hospital_id'],
             specialization=request.form['specialization'],
             experience=int(request.form['experience']),
             consultation_fee=float(request.form['consultation_fee']),
@@ -438,6 +1666,7 @@ def add_doctor():
         )
         db.session.add(doctor)
         db.session.commit()
+        invalidate_clinic_structure()
         flash(f'Doctor {doctor_user.name} added successfully!', 'success')
         return redirect(url_for('hospital_dashboard'))
     except ValueError as e:
@@ -472,23 +1701,74 @@ def book_appointment(doctor_id):
                 hospital_id=doctor.hospital_id,
                 appointment_time=appointment_datetime,
                 symptoms=symptoms,
-                status='pending'
+                status='pending',
+                consultation_fee=doctor.consultation_fee
             )
             db.session.add(appointment)
+            db.session.flush()
+            if not claim_slot(doctor_id, appointment_datetime, appointment.id):
+                db.session.rollback()
+                metrics.BOOKINGS.labels(outcome='conflict').inc()
+                flash('That time slot is not available. Please choose another slot.', 'danger')
+                return redirect(url_for('book_appointment', doctor_id=doctor_id))
             db.session.commit()
+            metrics.BOOKINGS.labels(outcome='success').inc()
+            # Only the homepage's appointment counts change; the directory and chat context don't list bookings
+            homepage_cache.invalidate()
             flash('Appointment booked successfully! Waiting for doctor approval.', 'success')
             return redirect(url_for('patient_dashboard'))
         except Exception as e:
             db.session.rollback()
+            metrics.BOOKINGS.labels(outcome='error').inc()
             flash('Error booking appointment. Please try again.', 'danger')
             return redirect(url_for('book_appointment', doctor_id=doctor_id))
-    return render_template('book_appointment.html', doctor=doctor, today=datetime.now())
+    ensure_doctor_slots(doctor_id)
+    now = datetime.now()
+    slots_by_day = {}
+    for slot in free_slots(doctor_id, now, now + timedelta(days=7)):
+        slots_by_day.setdefault(slot.slot_time.date(), []).append(slot.slot_time)
+    return render_template('book_appointment.html', doctor=doctor, today=now, slots_by_day=slots_by_day)
+
+@app.route('/api/slots/next')
+def next_free_slots():
+    """Earliest free slots across every doctor of a specialization, read from the free-slot index."""
+    specialization = request.args.get('specialization', '').strip()
+    if not specialization:
+        return jsonify({'success': False, 'message': 'specialization is required'}), 400
+    hospital_id = request.args.get('hospital_id', type=int)
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    query = (db.session.query(AppointmentSlot.slot_time, Doctor.id, Doctor.hospital_id,
+                              Doctor.consultation_fee, User.name)
+        .join(Doctor, Doctor.id == AppointmentSlot.doctor_id)
+        .join(User, User.id == Doctor.user_id)
+        .filter(
+            AppointmentSlot.appointment_id.is_(None),
+            AppointmentSlot.slot_time > datetime.now(),
+            Doctor.specialization == specialization
+        ))
+    if hospital_id:
+        query = query.filter(Doctor.hospital_id == hospital_id)
+    rows = query.order_by(AppointmentSlot.slot_time, AppointmentSlot.doctor_id).limit(limit).all()
+    return jsonify({
+        'success': True,
+        'specialization': specialization,
+        'slots': [{
+            'doctor_id': doctor_id,
+            'doctor_name': doctor_name,
+            'hospital_id': slot_hospital_id,
+            'consultation_fee': fee,
+            'appointment_date': slot_time.strftime('%Y-%m-%d'),
+            'appointment_time': slot_time.strftime('%H:%M'),
+            'book_url': url_for('book_appointment', doctor_id=doctor_id)
+        } for slot_time, doctor_id, slot_hospital_id, fee, doctor_name in rows]
+    })
 
 @app.route('/patient/dashboard')
+@replica_reads
 @login_required
 @role_required(['patient'])
 def patient_dashboard():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     upcoming_appointments = Appointment.query.filter_by(
         patient_id=session['user_id']
     ).filter(
@@ -503,10 +1783,11 @@ def patient_dashboard():
     return render_template('patient/dashboard.html', user=user, upcoming_appointments=upcoming_appointments, past_appointments=past_appointments)
 
 @app.route('/patient/medical-history')
+@replica_reads
 @login_required
 @role_required(['patient'])
 def patient_medical_history():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     medical_history = Appointment.query.filter_by(
         patient_id=session['user_id'],
         status='completed'
@@ -524,90 +1805,143 @@ def view_appointment_details(appointment_id):
     return render_template('patient/appointment_details.html', appointment=appointment)
 
 @app.route('/doctor/dashboard')
+@replica_reads
 @login_required
 def doctor_dashboard():
-    if session.get('user_type') != 'doctor':
+    user = current_user()
+    if user['user_type'] != 'doctor':
         flash('Access denied. This page is only for doctors.', 'danger')
         return redirect(url_for('index'))
     try:
-        doctor = Doctor.query.filter_by(user_id=session.get('user_id')).first()
+        # The dashboard only needs the doctor's id and name, both in the cached identity
+        doctor = {'id': user['doctor_id'], 'name': user['name']} if user['doctor_id'] else None
         if not doctor:
             flash('Doctor profile not found.', 'danger')
             return redirect(url_for('index'))
-        today = datetime.now().date()
-        pending_appointments = (Appointment.query
-            .join(User, User.id == Appointment.patient_id)
-            .filter(Appointment.doctor_id == doctor.id, Appointment.status == 'pending')
-            .order_by(Appointment.appointment_time).all())
-        todays_appointments = (Appointment.query
-            .join(User, User.id == Appointment.patient_id)
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        tomorrow_start = today_start + timedelta(days=1)
+        status_counts = dict(db.session.query(Appointment.status, db.func.count(Appointment.id))
+            .filter(Appointment.doctor_id == doctor['id'])
+            .group_by(Appointment.status).all())
+        active_appointments = (Appointment.query
+            .options(db.joinedload(Appointment.patient))
             .filter(
-                Appointment.doctor_id == doctor.id,
-                Appointment.appointment_time >= datetime.combine(today, datetime.min.time()),
-                Appointment.appointment_time < datetime.combine(today, datetime.max.time()),
-                Appointment.status == 'approved'
-            ).order_by(Appointment.appointment_time).all())
-        upcoming_appointments = (Appointment.query
-            .join(User, User.id == Appointment.patient_id)
-            .filter(
-                Appointment.doctor_id == doctor.id,
-                Appointment.appointment_time > datetime.combine(today, datetime.max.time()),
-                Appointment.status == 'approved'
-            ).order_by(Appointment.appointment_time).all())
-        completed_appointments = (Appointment.query
-            .join(User, User.id == Appointment.patient_id)
-            .filter(Appointment.doctor_id == doctor.id, Appointment.status == 'completed')
-            .order_by(Appointment.appointment_time.desc()).all())
+                Appointment.doctor_id == doctor['id'],
+                db.or_(
+                    Appointment.status == 'pending',
+                    db.and_(
+                        Appointment.status == 'approved',
+                        Appointment.appointment_time >= today_start,
+                        Appointment.appointment_time < tomorrow_start
+                    )
+                )
+            ).order_by(Appointment.appointment_time, Appointment.id).all())
+        pending_appointments = [a for a in active_appointments if a.status == 'pending']
+        todays_appointments = [a for a in active_appointments if a.status == 'approved']
+        upcoming_appointments, upcoming_cursor = keyset_page(
+            Appointment.query
+                .options(db.joinedload(Appointment.patient))
+                .filter(
+                    Appointment.doctor_id == doctor['id'],
+                    Appointment.appointment_time >= tomorrow_start,
+                    Appointment.status == 'approved'
+                ),
+            Appointment.appointment_time, Appointment.id,
+            request.args.get('upcoming_after'), DASHBOARD_PAGE_SIZE)
+        completed_appointments, completed_cursor = keyset_page(
+            Appointment.query
+                .options(db.joinedload(Appointment.patient))
+                .filter(Appointment.doctor_id == doctor['id'], Appointment.status == 'completed'),
+            Appointment.appointment_time, Appointment.id,
+            request.args.get('completed_before'), DASHBOARD_PAGE_SIZE, descending=True)
         return render_template('doctor/dashboard.html',
             doctor=doctor,
+            status_counts=status_counts,
             pending_appointments=pending_appointments,
             todays_appointments=todays_appointments,
             upcoming_appointments=upcoming_appointments,
-            completed_appointments=completed_appointments)
+            upcoming_cursor=upcoming_cursor,
+            completed_appointments=completed_appointments,
+            completed_cursor=completed_cursor)
     except Exception as e:
         flash('An error occurred while loading the dashboard.', 'danger')
         return redirect(url_for('index'))
 
 @app.route('/hospital/dashboard')
+@replica_reads
 @login_required
 def hospital_dashboard():
-    if session.get('user_type') != 'hospital_admin':
+    user = current_user()
+    if user['user_type'] != 'hospital_admin':
         flash('Access denied. This page is only for hospitals.', 'danger')
         return redirect(url_for('index'))
     try:
-        hospital = Hospital.query.filter_by(admin_id=session.get('user_id')).first()
+        hospital = db.session.get(Hospital, user['hospital_id']) if user['hospital_id'] else None
         if not hospital:
             flash('Hospital profile not found.', 'danger')
             return redirect(url_for('index'))
-        doctors = Doctor.query.filter_by(hospital_id=hospital.id).all()
+        doctors = Doctor.query.options(db.joinedload(Doctor.user)).filter_by(hospital_id=hospital.id).all()
         today = datetime.now().date()
-        tomorrow = today + timedelta(days=1)
+        today_start = datetime.combine(today, datetime.min.time())
+        week_start = today - timedelta(days=6)
+        status_counts, revenue, doctor_stats = {}, 0, {}
+        for doctor_id, status, count, fee_total in (db.session.query(
+                AppointmentRollup.doctor_id, AppointmentRollup.status,
+                AppointmentRollup.appointment_count, AppointmentRollup.fee_total)
+                .filter(AppointmentRollup.hospital_id == hospital.id)):
+            status_counts[status] = status_counts.get(status, 0) + count
+            stats = doctor_stats.setdefault(doctor_id, {'total': 0, 'completed': 0, 'revenue': 0})
+            stats['total'] += count
+            if status == 'completed':
+                stats['completed'] += count
+                stats['revenue'] += fee_total
+                revenue += fee_total
+        total_appointments = sum(status_counts.values())
+        completion_rate = round(100 * status_counts.get('completed', 0) / total_appointments, 1) if total_appointments else 0
+        daily_stats = {week_start + timedelta(days=offset): {'total': 0, 'completed': 0, 'revenue': 0} for offset in range(7)}
+        for day, status, count, fee_total in (db.session.query(
+                AppointmentDailyRollup.day, AppointmentDailyRollup.status,
+                db.func.sum(AppointmentDailyRollup.appointment_count), db.func.sum(AppointmentDailyRollup.fee_total))
+                .filter(
+                    AppointmentDailyRollup.hospital_id == hospital.id,
+                    AppointmentDailyRollup.day >= week_start,
+                    AppointmentDailyRollup.day <= today
+                ).group_by(AppointmentDailyRollup.day, AppointmentDailyRollup.status)):
+            stats = daily_stats[day]
+            stats['total'] += count
+            if status == 'completed':
+                stats['completed'] += count
+                stats['revenue'] += fee_total
         today_appointments = (Appointment.query
-            .join(Doctor)
+            .options(db.joinedload(Appointment.patient), db.joinedload(Appointment.doctor).joinedload(Doctor.user))
             .filter(
-                Doctor.hospital_id == hospital.id,
-                Appointment.appointment_time >= datetime.combine(today, datetime.min.time()),
-                Appointment.appointment_time < datetime.combine(tomorrow, datetime.min.time())
+                Appointment.hospital_id == hospital.id,
+                Appointment.appointment_time >= today_start,
+                Appointment.appointment_time < today_start + timedelta(days=1)
             ).order_by(Appointment.appointment_time).all())
-        pending_appointments = (Appointment.query
-            .join(Doctor)
-            .filter(Doctor.hospital_id == hospital.id, Appointment.status == 'pending')
-            .order_by(Appointment.appointment_time).all())
-        completed_appointments = (Appointment.query
-            .join(Doctor)
-            .filter(Doctor.hospital_id == hospital.id, Appointment.status == 'completed')
-            .order_by(Appointment.appointment_time.desc()).all())
+        pending_appointments, pending_cursor = keyset_page(
+            Appointment.query
+                .options(db.joinedload(Appointment.patient), db.joinedload(Appointment.doctor).joinedload(Doctor.user))
+                .filter(Appointment.hospital_id == hospital.id, Appointment.status == 'pending'),
+            Appointment.appointment_time, Appointment.id,
+            request.args.get('pending_after'), DASHBOARD_PAGE_SIZE)
         return render_template('hospital/dashboard.html',
             hospital=hospital,
             doctors=doctors,
             today_appointments=today_appointments,
             pending_appointments=pending_appointments,
-            completed_appointments=completed_appointments)
+            pending_cursor=pending_cursor,
+            status_counts=status_counts,
+            revenue=revenue,
+            completion_rate=completion_rate,
+            doctor_stats=doctor_stats,
+            daily_stats=daily_stats)
     except Exception as e:
         flash('An error occurred while loading the dashboard.', 'danger')
         return redirect(url_for('index'))
 
 @app.route('/hospital/<int:hospital_id>')
+@replica_reads
 def hospital_details(hospital_id):
     hospital = Hospital.query.options(db.joinedload(Hospital.doctors).joinedload(Doctor.user)).get_or_404(hospital_id)
     today = datetime.now().date()
@@ -616,7 +1950,8 @@ def hospital_details(hospital_id):
 @app.route('/update_appointment_status', methods=['POST'])
 @login_required
 def update_appointment_status():
-    if session.get('user_type') != 'doctor':
+    user = current_user()
+    if user['user_type'] != 'doctor':
         return jsonify({'success': False, 'message': 'Only doctors can update appointments'}), 403
     try:
         data = request.get_json()
@@ -624,17 +1959,25 @@ def update_appointment_status():
         new_status = data.get('status')
         if not appointment_id or not new_status:
             return jsonify({'success': False, 'message': 'Missing appointment_id or status'}), 400
-        doctor = Doctor.query.filter_by(user_id=session.get('user_id')).first()
-        if not doctor:
+        if new_status not in APPOINTMENT_STATUSES:
+            return jsonify({'success': False, 'message': f'Unknown status {new_status!r}'}), 400
+        if not user['doctor_id']:
             return jsonify({'success': False, 'message': 'Doctor profile not found'}), 404
         appointment = Appointment.query.get(appointment_id)
         if not appointment:
             return jsonify({'success': False, 'message': 'Appointment not found'}), 404
-        if appointment.doctor_id != doctor.id:
+        if appointment.doctor_id != user['doctor_id']:
             return jsonify({'success': False, 'message': 'You can only update your own appointments'}), 403
+        if appointment.status in RELEASED_STATUSES and new_status not in RELEASED_STATUSES:
+            # Its slot was given up; take it back unless another patient has booked it since
+            if not claim_slot(appointment.doctor_id, appointment.appointment_time, appointment.id):
+                db.session.rollback()
+                return jsonify({'success': False, 'message': 'That time slot has been booked by another patient'}), 409
         appointment.status = new_status
         if new_status == 'completed':
             appointment.completed_at = datetime.utcnow()
+        elif new_status in RELEASED_STATUSES:
+            release_slot(appointment.id)
         db.session.commit()
         return jsonify({'success': True, 'message': f'Appointment {new_status} successfully'})
     except Exception as e:
@@ -645,9 +1988,8 @@ def update_appointment_status():
 @login_required
 @role_required(['doctor'])
 def doctor_appointment_details(appointment_id):
-    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     appointment = Appointment.query.get_or_404(appointment_id)
-    if appointment.doctor_id != doctor.id:
+    if appointment.doctor_id != current_user()['doctor_id']:
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('doctor_dashboard'))
     if request.method == 'POST':
@@ -669,7 +2011,7 @@ def doctor_appointment_details(appointment_id):
         except Exception as e:
             db.session.rollback()
             flash('Error updating medical records.', 'danger')
-    return render_template('doctor/appointment_details.html', appointment=appointment, doctor=doctor)
+    return render_template('doctor/appointment_details.html', appointment=appointment)
 
 @app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
 def cancel_appointment(appointment_id):
@@ -681,6 +2023,7 @@ def cancel_appointment(appointment_id):
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         if appointment.status != 'pending':
             return jsonify({'success': False, 'message': 'Can only cancel pending appointments'}), 400
+        release_slot(appointment.id)
         db.session.delete(appointment)
         db.session.commit()
         return jsonify({'success': True})
@@ -739,27 +2082,51 @@ def delete_emergency_contact(contact_id):
 @login_required
 def book_ambulance():
     try:
-        booking = AmbulanceBooking(
+        pickup_lat = optional_float(request.form.get('pickup_lat'))
+        pickup_lng = optional_float(request.form.get('pickup_lng'))
+        destination_hospital = request.form.get('destination_hospital') or None
+        destination_lat = optional_float(request.form.get('destination_lat'))
+        destination_lng = optional_float(request.form.get('destination_lng'))
+        if destination_hospital is None and pickup_lat is not None and pickup_lng is not None:
+            # No destination chosen: take the patient to the closest registered hospital
+            nearest = nearest_hospitals(pickup_lat, pickup_lng, 1, AMBULANCE_DESTINATION_MAX_KM)
+            if nearest:
+                hospital = nearest[0][0]
+                destination_hospital, destination_lat, destination_lng = hospital.name, hospital.latitude, hospital.longitude
+        fields = dict(
             user_id=session['user_id'],
             patient_name=request.form['patient_name'],
             phone=request.form['phone'],
             pickup_address=request.form['pickup_address'],
-            pickup_lat=float(request.form.get('pickup_lat', 0)),
-            pickup_lng=float(request.form.get('pickup_lng', 0)),
-            destination_hospital=request.form.get('destination_hospital'),
-            destination_lat=float(request.form.get('destination_lat', 0)) if request.form.get('destination_lat') else None,
-            destination_lng=float(request.form.get('destination_lng', 0)) if request.form.get('destination_lng') else None,
+            pickup_lat=pickup_lat,
+            pickup_lng=pickup_lng,
+            destination_hospital=destination_hospital,
+            destination_lat=destination_lat,
+            destination_lng=destination_lng,
             emergency_type=request.form.get('emergency_type'),
             patient_condition=request.form.get('patient_condition'),
             status='requested'
         )
-        db.session.add(booking)
-        db.session.commit()
-        return jsonify({
-            'success': True,
-            'message': 'Ambulance requested successfully! Emergency services will contact you shortly.',
-            'booking_id': booking.id
-        })
+        try:
+            booking = ambulance_dispatch_queue.submit(fields).result(timeout=DISPATCH_TIMEOUT)
+        except FutureTimeout:
+            print(f"✗ Ambulance dispatch queue stalled ({ambulance_dispatch_queue.depth()} waiting)")
+            return jsonify({'success': False,
+                            'message': 'Ambulance booking is delayed. Please call 108 directly.'}), 503
+        except Exception as e:
+            # The batch rolled back; store this request unassigned so dispatch-pending picks it up
+            print(f"✗ Ambulance dispatch failed: {e}")
+            stored = AmbulanceBooking(**fields)
+            db.session.add(stored)
+            db.session.commit()
+            booking = ambulance_booking_json(stored)
+        if booking['status'] == 'dispatched':
+            arrival = datetime.fromisoformat(booking['estimated_arrival'])
+            minutes = max(1, round((arrival - datetime.utcnow()).total_seconds() / 60))
+            message = f"Ambulance {booking['ambulance_number']} is on its way! Estimated arrival in {minutes} minutes."
+        else:
+            message = 'Ambulance requested successfully! Emergency services will contact you shortly.'
+        return jsonify(dict(booking, success=True, message=message))
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -767,17 +2134,118 @@ def book_ambulance():
 @app.route('/emergency/ambulance/status/<int:booking_id>')
 @login_required
 def ambulance_status(booking_id):
+    """Polling fallback for the status stream, served from memory for a few seconds per booking."""
+    cached = ambulance_status_cache.get(booking_id)
+    if cached is None:
+        booking = AmbulanceBooking.query.get_or_404(booking_id)
+        cached = (booking.user_id, ambulance_booking_json(booking))
+        ambulance_status_cache.set(booking_id, cached)
+    owner_id, state = cached
+    if owner_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    # Fresher whenever someone is following the booking's stream in this worker
+    state = booking_status_hub.current(booking_id) or state
+    response = jsonify(dict(state, success=True))
+    response.headers['Cache-Control'] = f'private, max-age={AMBULANCE_STATUS_CACHE_TTL}'
+    return response
+
+@app.route('/emergency/ambulance/status/<int:booking_id>/stream')
+@login_required
+def ambulance_status_stream(booking_id):
+    """Server-sent ``status`` events for a booking: the current state, then every change until it is over."""
     booking = AmbulanceBooking.query.get_or_404(booking_id)
     if booking.user_id != session['user_id']:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-    return jsonify({
-        'success': True,
-        'status': booking.status,
-        'ambulance_number': booking.ambulance_number,
-        'driver_name': booking.driver_name,
-        'driver_phone': booking.driver_phone,
-        'estimated_arrival': booking.estimated_arrival.isoformat() if booking.estimated_arrival else None
-    })
+    state = ambulance_booking_json(booking)
+    db.session.close()
+
+    def generate():
+        subscription = booking_status_hub.subscribe(booking_id, state)
+        # Streams end after a while and the browser reconnects, so no connection is held forever
+        deadline = time.monotonic() + AMBULANCE_STATUS_STREAM_SECONDS
+        try:
+            yield 'retry: 3000\n\n'
+            while (remaining := deadline - time.monotonic()) > 0:
+                update = subscription.get(timeout=min(15, remaining))
+                if update is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield sse_event(update, event='status')
+                if update['status'] in ('completed', 'cancelled'):
+                    yield sse_event({}, event='done')
+                    return
+        finally:
+            booking_status_hub.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+def fleet_authorized():
+    supplied = request.headers.get('Authorization', '')
+    return (bool(FLEET_TOKEN) and secrets.compare_digest(supplied, f'Bearer {FLEET_TOKEN}')) or is_admin_request()
+
+@app.route('/api/fleet/<int:unit_id>/position', methods=['POST'])
+def update_ambulance_position(unit_id):
+    """Live position report from an ambulance crew's device."""
+    if not fleet_authorized():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    data = request.get_json(silent=True) or request.form
+    lat, lng = optional_float(data.get('lat')), optional_float(data.get('lng'))
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'success': False, 'message': 'Valid lat and lng are required'}), 400
+    unit = Ambulance.query.get_or_404(unit_id)
+    unit.latitude, unit.longitude, unit.position_updated_at = lat, lng, datetime.utcnow()
+    booking = AmbulanceBooking.query.get(unit.booking_id) if unit.booking_id else None
+    if booking is not None and booking.status == 'dispatched' and booking.pickup_lat is not None:
+        # Already on the road: no turnout time, only what is left of the drive
+        distance = haversine_km(lat, lng, booking.pickup_lat, booking.pickup_lng)
+        eta = datetime.utcnow() + timedelta(minutes=eta_minutes(distance, AMBULANCE_SPEED_KMH, turnout_minutes=0))
+        # Whole-minute changes only, so position pings don't rewrite the booking every time
+        if booking.estimated_arrival is None or abs((eta - booking.estimated_arrival).total_seconds()) >= 60:
+            booking.estimated_arrival = eta
+    db.session.commit()
+    dispatcher.update(unit.id, lat, lng, available=unit.status == 'available')
+    return jsonify({'success': True})
+
+@app.route('/api/fleet/<int:unit_id>/status', methods=['POST'])
+def update_ambulance_status(unit_id):
+    """Crew status: ``arrived`` or ``completed`` for the current job, ``available`` or ``offline`` for the unit."""
+    if not fleet_authorized():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    status = (request.get_json(silent=True) or request.form).get('status')
+    if status not in ('arrived', 'completed', 'available', 'offline'):
+        return jsonify({'success': False, 'message': 'Unknown status'}), 400
+    unit = Ambulance.query.get_or_404(unit_id)
+    booking = AmbulanceBooking.query.get(unit.booking_id) if unit.booking_id else None
+    if status in ('arrived', 'completed'):
+        if booking is None:
+            return jsonify({'success': False, 'message': 'No current job'}), 409
+        booking.status = status
+        if status == 'completed':
+            unit.status, unit.booking_id = 'available', None
+    elif booking is not None:
+        return jsonify({'success': False, 'message': 'Complete the current job first'}), 409
+    else:
+        unit.status = status
+    db.session.commit()
+    dispatcher.update(unit.id, unit.latitude, unit.longitude, available=unit.status == 'available')
+    assigned = dispatch_pending() if unit.status == 'available' else 0
+    return jsonify({'success': True, 'status': unit.status, 'dispatched_waiting': assigned})
+
+@app.route('/admin/fleet')
+def fleet_report():
+    if not is_admin_request():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    units = dict(db.session.query(Ambulance.status, db.func.count(Ambulance.id)).group_by(Ambulance.status).all())
+    waiting = AmbulanceBooking.query.filter_by(status='requested').count()
+    return jsonify({'success': True, 'units': units, 'waiting_bookings': waiting,
+                    'dispatcher': dict(dispatcher.stats(), queue_depth=ambulance_dispatch_queue.depth(),
+                                       batches=ambulance_dispatch_queue.batches),
+                    'status_streams': booking_status_hub.stats()})
 
 @app.route('/emergency/my-bookings')
 @login_required
@@ -785,44 +2253,12 @@ def my_ambulance_bookings():
     bookings = AmbulanceBooking.query.filter_by(user_id=session['user_id']).order_by(AmbulanceBooking.created_at.desc()).all()
     return render_template('patient/ambulance_bookings.html', bookings=bookings)
 
-@app.route('/api/chat', methods=['POST'])
-def chat_with_ai():
-    try:
-        data = request.get_json()
-        user_message = data.get('message', '').strip()
-        
-        print(f"Received message: {user_message}")
-        
-        if not user_message:
-            return jsonify({'error': 'Message is required'}), 400
-            
-        if not model:
-            print("Warning: Model not initialized - running in demo mode")
-            return jsonify({
-                'response': "I'm currently in demo mode. To enable real AI responses, please add your Gemini API key to the .env file."
-            })
-            
-        total_hospitals = Hospital.query.count()
-        total_doctors = Doctor.query.count()
-        total_patients = User.query.filter_by(user_type='patient').count()
-        total_appointments = Appointment.query.count()
-        pending_appointments = Appointment.query.filter_by(status='pending').count()
-        completed_appointments = Appointment.query.filter_by(status='completed').count()
-        
-        hospitals_info = []
-        hospitals = Hospital.query.all()
-        for hospital in hospitals:
-            doctors_count = Doctor.query.filter_by(hospital_id=hospital.id).count()
-            hospitals_info.append(f"- {hospital.name} ({doctors_count} doctors)")
-        
-        specializations = db.session.query(Doctor.specialization).distinct().all()
-        specializations_list = [s[0] for s in specializations]
-        system_prompt = f"""You are SmartClinic AI, an intelligent and comprehensive medical assistant. You MUST provide DETAILED, THOROUGH responses like a knowledgeable doctor would.
+CHAT_PROMPT_TEMPLATE = """You are SmartClinic AI, an intelligent and comprehensive medical assistant. You MUST provide DETAILED, THOROUGH responses like a knowledgeable doctor would.
 
 SYSTEM DATA:
 - Hospitals: {total_hospitals} | Doctors: {total_doctors} | Patients: {total_patients}
-- Our Hospitals: {', '.join([h.split(' (')[0].replace('- ', '') for h in hospitals_info]) if hospitals_info else "Multiple partner hospitals"}
-- Specializations: {', '.join(specializations_list) if specializations_list else "All major specializations"}
+- Our Hospitals: {hospital_names}
+- Specializations: {specializations}
 
 CRITICAL INSTRUCTIONS - YOU MUST FOLLOW THIS FORMAT FOR EVERY HEALTH QUERY:
 
@@ -898,33 +2334,254 @@ An **Orthopedic** specialist is recommended for back pain. They specialize in mu
 REMEMBER: ALWAYS give this level of detail for ANY health question. Never give short responses. Be comprehensive and helpful like a real doctor consultation.
 
 User message: """
-        response = model.generate_content(system_prompt + user_message)
-        ai_response = response.text
+
+def build_chat_context():
+    """Render the chat system prompt from one grouped hospital/doctor query plus two small lookups."""
+    hospital_rows = (db.session.query(Hospital.name, db.func.count(Doctor.id))
+        .outerjoin(Doctor, Doctor.hospital_id == Hospital.id)
+        .group_by(Hospital.id, Hospital.name).all())
+    total_patients = User.query.filter_by(user_type='patient').count()
+    specializations = [row[0] for row in db.session.query(Doctor.specialization).distinct()]
+    prompt = CHAT_PROMPT_TEMPLATE.format(
+        total_hospitals=len(hospital_rows),
+        total_doctors=sum(count for _, count in hospital_rows),
+        total_patients=total_patients,
+        hospital_names=', '.join(name for name, _ in hospital_rows) if hospital_rows else "Multiple partner hospitals",
+        specializations=', '.join(specializations) if specializations else "All major specializations"
+    )
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12], prompt
+
+def _refresh_chat_context():
+    try:
+        with app.app_context():
+            version, prompt = build_chat_context()
+        with chat_context_lock:
+            chat_context.update(version=version, prompt=prompt, built_at=time.monotonic())
+    except Exception as e:
+        print(f"Chat context refresh failed: {e}")
+    finally:
+        with chat_context_lock:
+            chat_context['refreshing'] = False
+
+def get_chat_context():
+    """Return ``(version, system_prompt)`` from the shared snapshot.
+
+    Only the very first call builds the snapshot inline. Once it is older than
+    CHAT_CONTEXT_TTL or invalidated by a write, callers keep getting the current snapshot
+    while one background thread rebuilds it. The version is a hash of the prompt, so it
+    only changes when the clinic data behind it does.
+    """
+    if chat_context['prompt'] is None:
+        version, prompt = build_chat_context()
+        with chat_context_lock:
+            if chat_context['prompt'] is None:
+                chat_context.update(version=version, prompt=prompt, built_at=time.monotonic())
+    with chat_context_lock:
+        stale = time.monotonic() - chat_context['built_at'] > CHAT_CONTEXT_TTL
+        if stale and not chat_context['refreshing']:
+            chat_context['refreshing'] = True
+            threading.Thread(target=_refresh_chat_context, daemon=True).start()
+        return chat_context['version'], chat_context['prompt']
+
+DEMO_MODE_RESPONSE = "I'm currently in demo mode. To enable real AI responses, please add your Gemini API key to the .env file."
+
+def chat_error_message(error):
+    error_msg = str(error)
+    if isinstance(error, (CircuitOpen, Overloaded)) or is_quota_error(error):
+        return "⚠️ I'm currently experiencing high demand. Please try again in a few seconds, or try again later. Our AI service has a daily limit on the free tier."
+    return f"I'm having trouble processing your request. Error: {error_msg}"
+
+def chat_cache_key(version, message):
+    """Case, punctuation and spacing differences ("Back pain?" vs "back  pain") share one entry."""
+    return version, ' '.join(re.sub(r'[^\w\s]', ' ', message.lower()).split())
+
+def is_quota_error(error):
+    error_msg = str(error)
+    return '429' in error_msg or 'quota' in error_msg.lower()
+
+# Keep AI outages and slowness away from the rest of the app: bounded concurrency with a short
+# queue, one upstream call per identical in-flight question, and fail-fast after quota errors
+gemini_limiter = ConcurrencyLimiter(
+    max_in_flight=int(os.getenv('GEMINI_MAX_IN_FLIGHT', 8)),
+    max_queue=int(os.getenv('GEMINI_MAX_QUEUE', 32)),
+    timeout=float(os.getenv('GEMINI_QUEUE_TIMEOUT', 5)))
+gemini_calls = SingleFlight()
+gemini_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('GEMINI_BREAKER_THRESHOLD', 3)),
+    reset_timeout=float(os.getenv('GEMINI_BREAKER_RESET', 30)),
+    is_failure=is_quota_error)
+
+def gemini_error_kind(error):
+    return 'quota' if is_quota_error(error) else 'error'
+
+def generate_chat_response(prompt, cache_key):
+    def generate():
+        with metrics.gemini_call('blocking', gemini_error_kind):
+            return model.generate_content(prompt).text
+
+    def call_upstream():
+        return gemini_breaker.call(lambda: gemini_limiter.run(generate))
+    return gemini_calls.do(cache_key, call_upstream)
+
+@app.route('/api/chat', methods=['POST'])
+def chat_with_ai():
+    try:
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+        
+        print(f"Received message: {user_message}")
+        
+        if not user_message:
+            return jsonify({'error': 'Message is required'}), 400
+            
+        if not model:
+            print("Warning: Model not initialized - running in demo mode")
+            return jsonify({'response': DEMO_MODE_RESPONSE})
+            
+        version, system_prompt = get_chat_context()
+        cache_key = chat_cache_key(version, user_message)
+        ai_response = chat_response_cache.get(cache_key)
+        if ai_response is not None:
+            return jsonify({'response': ai_response})
+        ai_response = generate_chat_response(system_prompt + user_message, cache_key)
+        if ai_response:
+            chat_response_cache.set(cache_key, ai_response)
         
         print(f"AI Response generated successfully")
         
         return jsonify({'response': ai_response})
+    except (CircuitOpen, Overloaded) as e:
+        print(f"AI Chat shed: {e}")
+        metrics.GEMINI_SHED.labels(reason=type(e).__name__).inc()
+        return jsonify({'response': chat_error_message(e)})
     except Exception as e:
-        error_msg = str(e)
-        print(f"AI Chat Error: {error_msg}")
+        print(f"AI Chat Error: {e}")
         import traceback
         traceback.print_exc()
-        
-        if '429' in error_msg or 'quota' in error_msg.lower():
-            return jsonify({
-                'response': "⚠️ I'm currently experiencing high demand. Please try again in a few seconds, or try again later. Our AI service has a daily limit on the free tier."
-            })
-        return jsonify({
-            'response': f"I'm having trouble processing your request. Error: {error_msg}"
-        })
+        return jsonify({'response': chat_error_message(e)})
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_with_ai_stream():
+    """Server-sent events variant of /api/chat that forwards model output as it is generated."""
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return jsonify({'error': 'Message is required'}), 400
+    system_prompt = cache_key = cached_response = None
+    if model:
+        try:
+            version, system_prompt = get_chat_context()
+            cache_key = chat_cache_key(version, user_message)
+            cached_response = chat_response_cache.get(cache_key)
+        except Exception as e:
+            print(f"AI Chat Error: {e}")
+            return jsonify({'response': chat_error_message(e)})
+    # Hand the DB connection back to the pool before the long-lived stream starts
+    db.session.close()
+
+    def generate():
+        if not model or cached_response is not None:
+            yield sse_event({'text': cached_response if model else DEMO_MODE_RESPONSE})
+            yield sse_event({}, event='done')
+            return
+        try:
+            gemini_breaker.before_call()
+            gemini_limiter.acquire()
+        except (CircuitOpen, Overloaded) as e:
+            print(f"AI Chat shed: {e}")
+            metrics.GEMINI_SHED.labels(reason=type(e).__name__).inc()
+            yield sse_event({'text': chat_error_message(e)}, event='error')
+            return
+        try:
+            parts = []
+            with metrics.gemini_call('stream', gemini_error_kind):
+                for chunk in model.generate_content(system_prompt + user_message, stream=True):
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. safety metadata) have nothing to forward
+                        continue
+                    if text:
+                        parts.append(text)
+                        yield sse_event({'text': text})
+            gemini_breaker.record_success()
+            # A stream with no text (everything filtered or blocked) is not an answer worth replaying
+            if parts:
+                chat_response_cache.set(cache_key, ''.join(parts))
+            yield sse_event({}, event='done')
+        except GeneratorExit:
+            # Client went away mid-stream: no verdict on Gemini, but a half-open trial must not stay held
+            gemini_breaker.record_abandoned()
+            raise
+        except Exception as e:
+            gemini_breaker.record_failure(e)
+            print(f"AI Chat Error: {e}")
+            yield sse_event({'text': chat_error_message(e)}, event='error')
+        finally:
+            gemini_limiter.release()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/cache-stats')
+def chat_cache_stats():
+    if not is_admin_request():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    stats = chat_response_cache.stats()
+    stats['upstream'] = {
+        'circuit': gemini_breaker.state,
+        'waiting': gemini_limiter.waiting,
+        'rejected': gemini_limiter.rejected,
+        'coalesced': gemini_calls.coalesced
+    }
+    return jsonify(stats)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@app.route('/admin/db-pool')
+def db_pool_report():
+    if not is_admin_request():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    options = {key: value for key, value in app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()
+               if key not in ('connect_args', 'poolclass')}
+    return jsonify({'success': True, 'dialect': db.engine.dialect.name, 'engine_options': options, 'pool': pool_stats(),
+                    'replicas': replica_router.report()})
+
+@app.route('/admin/admission')
+def admission_report():
+    """Admission slots in use, queued and shed requests per priority lane, for this worker."""
+    if not is_admin_request():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    return jsonify(dict(admission.stats(), success=True))
+
+@app.route('/admin/sql-profile', methods=['GET', 'DELETE'])
+def sql_profile_report():
+    """Routes with the most database time among sampled requests; DELETE clears the totals."""
+    if not is_admin_request():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    if request.method == 'DELETE':
+        query_profiler.reset()
+        return jsonify({'success': True, 'message': 'SQL profile cleared'})
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify({
+        'success': True,
+        'sample_rate': query_profiler.sample_rate,
+        'slow_query_ms': query_profiler.slow_query_ms,
+        'duplicate_threshold': query_profiler.duplicate_threshold,
+        'routes': query_profiler.report(limit)
+    })
 
 @app.route('/setup-database-now')
 def setup_database():
     """One-time database setup endpoint - visit this URL to initialize the database"""
     try:
-        # Create all tables
-        with app.app_context():
-            db.create_all()
+        # Create all tables and apply pending schema migrations
+        migrations.upgrade(db.engine, db.metadata)
         
         # Check if data already exists
         if User.query.first():
@@ -935,10 +2592,11 @@ def setup_database():
                 'data': 'Sample data already present'
             })
         
-        # Add sample users
+        # Add sample users, all with the same password but each with its own salt
+        patient_hash, admin_hash, doctor_hash = password_hasher.hash_many(['password123'] * 3)
         patient_user = User(
             email='patient@example.com',
-            password_hash=generate_password_hash('password123'),
+            password_hash=patient_hash,
             name='John Patient',
             user_type='patient',
             phone='1234567890',
@@ -950,7 +2608,7 @@ def setup_database():
         
         hospital_admin = User(
             email='admin@hospital.com',
-            password_hash=generate_password_hash('password123'),
+            password_hash=admin_hash,
             name='Hospital Admin',
             user_type='hospital_admin',
             phone='9876543210'
@@ -958,7 +2616,7 @@ def setup_database():
         
         doctor_user = User(
             email='doctor@example.com',
-            password_hash=generate_password_hash('password123'),
+            password_hash=doctor_hash,
             name='Dr. Smith',
             user_type='doctor',
             phone='5555555555'
@@ -997,7 +2655,8 @@ def setup_database():
             hospital_id=hospital.id,
             appointment_time=datetime.now() + timedelta(days=1),
             symptoms='Regular checkup',
-            status='pending'
+            status='pending',
+            consultation_fee=doctor.consultation_fee
         )
         db.session.add(appointment)
         db.session.commit()
@@ -1049,7 +2708,7 @@ def reset_user_password():
         if not user:
             return jsonify({'status': 'error', 'message': 'User not found'}), 404
         
-        user.password_hash = generate_password_hash(new_password)
+        user.password_hash = password_hasher.hash(new_password)
         db.session.commit()
         
         return jsonify({
@@ -1073,75 +2732,21 @@ def smart_import_data():
         if secret != 'import-data-2026':
             return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
         
-        import_data = data.get('data', {})
-        imported = {'users': 0, 'hospitals': 0, 'doctors': 0}
-        
-        # Import users first
-        for user_data in import_data.get('users', []):
-            existing = User.query.filter_by(email=user_data['email']).first()
-            if not existing:
-                user = User(
-                    email=user_data['email'],
-                    password_hash=generate_password_hash(user_data['password']),
-                    name=user_data['name'],
-                    user_type=user_data['user_type'],
-                    phone=user_data.get('phone')
-                )
-                db.session.add(user)
-                imported['users'] += 1
-        
-        db.session.commit()
-        
-        # Import hospitals
-        for hosp_data in import_data.get('hospitals', []):
-            existing = Hospital.query.filter_by(name=hosp_data['name']).first()
-            if not existing:
-                admin = User.query.filter_by(email=hosp_data['admin_email']).first()
-                if admin:
-                    hospital = Hospital(
-                        name=hosp_data['name'],
-                        address=hosp_data['address'],
-                        contact=hosp_data['contact'],
-                        admin_id=admin.id,
-                        description=hosp_data.get('description', '')
-                    )
-                    db.session.add(hospital)
-                    imported['hospitals'] += 1
-        
-        db.session.commit()
-        
-        # Import doctors
-        for doc_data in import_data.get('doctors', []):
-            existing = User.query.filter_by(email=doc_data['email']).first()
-            if not existing:
-                user = User(
-                    email=doc_data['email'],
-                    password_hash=generate_password_hash(doc_data['password']),
-                    name=doc_data['name'],
-                    user_type='doctor'
-                )
-                db.session.add(user)
-                db.session.flush()
-                
-                hospital = Hospital.query.filter_by(name=doc_data['hospital_name']).first()
-                if hospital:
-                    doctor = Doctor(
-                        user_id=user.id,
-                        hospital_id=hospital.id,
-                        specialization=doc_data['specialization'],
-                        experience=doc_data['experience'],
-                        consultation_fee=doc_data['fee'],
-                        about=doc_data.get('about', '')
-                    )
-                    db.session.add(doctor)
-                    imported['doctors'] += 1
-        
+        # Large networks belong in `flask bulk-import`; passwords here share the login hashing pool
+        result = BulkImport(db.session.connection(), db.metadata.tables, hasher=password_hasher, geocoder=geocoder).run(
+            data.get('data', {}))
         db.session.commit()
+        invalidate_clinic_structure()
+        if result['relocated']:
+            hospital_locator.invalidate()
+        identities.forget()
         
         return jsonify({
             'status': 'success',
             'message': '✅ Data imported successfully!',
-            'imported': imported,
+            'imported': result['imported'],
+            'updated': result['updated'],
+            'skipped': result['skipped'],
             'current_data': {
                 'users': User.query.count(),
                 'hospitals': Hospital.query.count(),
@@ -1176,37 +2781,29 @@ def import_production_data():
                 'message': 'Unauthorized: Invalid secret key'
             }), 403
         
-        # Read the SQL file
+        # Read the SQL file (or a jsonl export)
         import os
-        sql_file_path = os.path.join(os.path.dirname(__file__), 'production_data.sql')
+        candidates = [os.path.join(os.path.dirname(__file__), name) for name in
+                      ('production_data.sql', 'production_data.sql.gz', 'production_data.jsonl', 'production_data.jsonl.gz')]
+        sql_file_path = next((path for path in candidates if os.path.exists(path)), None)
         
-        if not os.path.exists(sql_file_path):
+        if sql_file_path is None:
             return jsonify({
                 'status': 'error',
                 'message': 'production_data.sql file not found. Please upload it first.'
             }), 404
         
-        with open(sql_file_path, 'r', encoding='utf-8') as f:
-            sql_content = f.read()
-        
-        # Parse and execute SQL statements
-        statements = sql_content.split(';')
-        executed = 0
-        errors = []
-        
-        for statement in statements:
-            statement = statement.strip()
-            if statement and not statement.startswith('--') and 'INSERT INTO' in statement:
-                try:
-                    db.session.execute(db.text(statement))
-                    executed += 1
-                except Exception as e:
-                    error_msg = str(e)
-                    # Skip duplicate entry errors
-                    if 'Duplicate entry' not in error_msg and 'UNIQUE constraint' not in error_msg:
-                        errors.append(f"Error in statement: {error_msg[:100]}")
-        
-        db.session.commit()
+        # Streamed in transactions; rows that already exist are skipped, or updated from an incremental export
+        loader = load_file(db.engine, sql_file_path, skip_existing=True)
+        # The export leaves out derived tables
+        rebuild_rollups()
+        attach_booked_appointments()
+        with db.engine.begin() as connection:
+            directory.setup_full_text(connection)
+            directory.rebuild(connection, db.metadata.tables)
+        invalidate_clinic_structure()
+        hospital_locator.invalidate()
+        identities.forget()
         
         # Count imported data
         total_users = User.query.count()
@@ -1216,8 +2813,9 @@ def import_production_data():
         return jsonify({
             'status': 'success',
             'message': '✅ Data imported successfully!',
-            'executed_statements': executed,
-            'errors': errors if errors else 'None',
+            'executed_statements': loader.statements,
+            'rows': loader.rows,
+            'errors': 'None',
             'current_data': {
                 'users': total_users,
                 'hospitals': total_hospitals,
@@ -1225,6 +2823,12 @@ def import_production_data():
             }
         })
         
+    except DumpError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'committed_statements': e.committed
+        }), 500
     except Exception as e:
         db.session.rollback()
         import traceback
@@ -0,0 +1,107 @@
+"""
+Benchmark nearest-hospital lookups.
+
+Seeds hospitals across the local geocoder's cities into a scratch database (SQLite by default),
+builds the KD-tree index and times nearest-k lookups, in memory and through
+/api/hospitals/nearest, checking the answers against a brute-force scan.
+
+    python bench_nearest.py --hospitals 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///bench_nearest.db')
+    parser.add_argument('--hospitals', type=int, default=100_000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=1_000)
+    parser.add_argument('--batch-size', type=int, default=20_000)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ['DATABASE_URL'] = args.database_url
+os.environ.setdefault('SECRET_KEY', 'bench')
+
+from app import app, db, hospital_locator, User, Hospital  # noqa: E402
+from fake_geocoder import CITIES, LocalGeocoder  # noqa: E402
+from geo import haversine_km  # noqa: E402
+import migrations  # noqa: E402
+
+geocoder = LocalGeocoder()
+
+
+def insert_batches(table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= args.batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def seed(rng):
+    print(f"Seeding {args.hospitals} hospitals...")
+    started = time.perf_counter()
+    cities = sorted(CITIES)
+    insert_batches(User.__table__, ({
+        'id': i, 'email': f'admin{i}@bench.local', 'password_hash': 'x', 'name': f'Admin {i}',
+        'user_type': 'hospital_admin'
+    } for i in range(1, args.hospitals + 1)))
+
+    def hospitals():
+        for i in range(1, args.hospitals + 1):
+            address = f'{i} Hospital Road, {rng.choice(cities).title()}'
+            lat, lng = geocoder.geocode(address)
+            yield {'id': i, 'name': f'Hospital {i}', 'address': address, 'admin_id': i,
+                   'latitude': lat, 'longitude': lng}
+    insert_batches(Hospital.__table__, hospitals())
+    print(f"Seeded in {time.perf_counter() - started:.1f}s\n")
+
+
+def main():
+    rng = random.Random(42)
+    with app.app_context():
+        db.drop_all()
+        migrations.version_metadata.drop_all(bind=db.engine)
+        migrations.upgrade(db.engine, db.metadata)
+        seed(rng)
+        hospital_locator.current()
+        print(f"Index built in {hospital_locator.build_seconds * 1000:.0f} ms")
+        points = [(row.id, row.latitude, row.longitude) for row in
+                  db.session.query(Hospital.id, Hospital.latitude, Hospital.longitude)]
+        # Query points around India, mostly near the seeded cities
+        targets = [(rng.uniform(8, 30), rng.uniform(70, 90)) for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        for lat, lng in targets:
+            hospital_locator.nearest(lat, lng, args.k)
+        print(f"In-memory nearest-{args.k}: {(time.perf_counter() - started) * 1000 / len(targets):.3f} ms/query")
+
+        client = app.test_client()
+        sample = targets[:100]
+        started = time.perf_counter()
+        for lat, lng in sample:
+            response = client.get(f'/api/hospitals/nearest?lat={lat}&lng={lng}&k={args.k}')
+            assert response.status_code == 200
+        print(f"/api/hospitals/nearest:  {(time.perf_counter() - started) * 1000 / len(sample):.3f} ms/request")
+
+        mismatches = 0
+        for lat, lng in targets[:20]:
+            expected = sorted(points, key=lambda point: haversine_km(lat, lng, point[1], point[2]))[:args.k]
+            found = hospital_locator.nearest(lat, lng, args.k)
+            mismatches += [point[0] for point in expected] != [key for key, _ in found]
+        print(f"\n{'✓' if mismatches == 0 else '✗'} {20 - mismatches}/20 lookups match a brute-force scan")
+        return 0 if mismatches == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Login throughput of password verification, per method and per core.
+
+For each hashing method, verifies one stored hash over and over: first inline on one core (the
+ceiling for a single request thread), then through ``PasswordHasher``'s process pool with many
+concurrent clients, the way a login peak hits a worker. Prints logins per second, logins per
+second per core and login latency percentiles.
+
+    python bench_passwords.py
+    python bench_passwords.py --method scrypt --method pbkdf2:sha256:600000 --logins 400 --clients 64
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from passwords import PasswordHasher, verify_and_update
+from resilience import Overloaded
+
+PASSWORD = 'bench-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--method', action='append', help='werkzeug hash method (repeatable; default: scrypt)')
+    parser.add_argument('--logins', type=int, default=200, help='verifications through the pool per method')
+    parser.add_argument('--inline-logins', type=int, default=20, help='verifications on one core per method')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='pool processes')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent logins')
+    parser.add_argument('--max-queue', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    return parser.parse_args()
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def bench_inline(pwhash, parameters, method, logins):
+    started = time.perf_counter()
+    for _ in range(logins):
+        verify_and_update(pwhash, PASSWORD, method, parameters)
+    return logins / (time.perf_counter() - started)
+
+
+def bench_pool(hasher, pwhash, logins, clients):
+    latencies, rejected = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client(count):
+        start.wait()
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                valid, _ = hasher.verify_and_update(pwhash, PASSWORD)
+                assert valid
+            except Overloaded:
+                with lock:
+                    rejected.append(1)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(logins // clients + (i < logins % clients),))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, len(rejected), time.perf_counter() - started
+
+
+def main():
+    args = parse_args()
+    cores = min(args.workers, os.cpu_count() or 1)
+    print(f"{args.workers} pool processes on {os.cpu_count()} CPUs, {args.clients} concurrent clients")
+    for method in args.method or ['scrypt']:
+        hasher = PasswordHasher(method, workers=args.workers, max_queue=args.max_queue, timeout=args.timeout)
+        pwhash = generate_password_hash(PASSWORD, method)
+        inline = bench_inline(pwhash, hasher.parameters, method, args.inline_logins)
+        # Start the pool processes outside the measurement
+        hasher.hash_many([PASSWORD] * args.workers)
+        latencies, rejected, wall = bench_pool(hasher, pwhash, args.logins, args.clients)
+        hasher.shutdown()
+        rate = len(latencies) / wall
+        print(f"\n{hasher.parameters}")
+        print(f"  inline:  {inline:,.1f} logins/s on one core ({1000 / inline:.0f} ms each)")
+        print(f"  pool:    {rate:,.1f} logins/s, {rate / cores:,.1f} per core, {rejected} turned away")
+        if latencies:
+            print(f"  latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms  p95 {percentile(latencies, 0.95) * 1000:.0f} ms  "
+                  f"max {max(latencies) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Set-based import of hospital networks: accounts, hospitals and doctors.
+
+Input is the smart-import document ``{"users": [...], "hospitals": [...], "doctors": [...]}``.
+Rows are matched on their natural keys (users and doctors by account email, hospitals by name):
+new rows are inserted, changed ones updated and identical ones left alone, so re-running an
+import is cheap and safe. Foreign keys are resolved from in-memory maps loaded with chunked
+``IN`` queries, and every write is an ``executemany`` of up to ``batch_size`` rows, all in the
+caller's transaction.
+
+Passwords: an account may carry a precomputed ``password_hash`` (as exported), a plaintext
+``password`` (hashed by ``hasher``'s process pool, which at ~0.1 s per scrypt hash dominates large
+imports) or neither, in which case it gets an unusable hash and needs a password reset before logging in.
+Existing accounts keep their password and user type; only name and phone are updated.
+"""
+import time
+
+import sqlalchemy as sa
+
+import directory
+from passwords import UNUSABLE_PASSWORD, PasswordHasher
+
+IN_CHUNK = 1000
+HOSPITAL_FIELDS = ('address', 'contact', 'description', 'admin_id')
+DOCTOR_FIELDS = ('hospital_id', 'specialization', 'experience', 'consultation_fee', 'about')
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _lookup(connection, key_column, value_columns, keys):
+    """``{key: row}`` for the rows whose ``key_column`` is in ``keys``."""
+    found = {}
+    for chunk in _chunks(set(keys), IN_CHUNK):
+        for row in connection.execute(sa.select(key_column, *value_columns).where(key_column.in_(chunk))):
+            found[row[0]] = row
+    return found
+
+
+def _changed(current, values):
+    return any(getattr(current, field) != value for field, value in values.items())
+
+
+def _update(table, key, fields):
+    return table.update().where(table.c.id == sa.bindparam(key)).values(
+        **{field: sa.bindparam(f'new_{field}') for field in fields})
+
+
+class BulkImport:
+    """One import run over ``connection``; ``run(data)`` returns the per-table counts."""
+
+    def __init__(self, connection, tables, batch_size=5000, hasher=None, geocoder=None, log=print):
+        self.connection = connection
+        self.tables = tables
+        self.batch_size = batch_size
+        self.hasher = hasher or PasswordHasher(workers=0)
+        self.geocoder = geocoder
+        self.log = log
+        self.counts = {name: {'inserted': 0, 'updated': 0, 'unchanged': 0}
+                       for name in ('users', 'hospitals', 'doctors')}
+        self.skipped = []
+        self.geocoded = 0
+        # Hospitals whose coordinates this import wrote, which the nearest-hospital index must pick up
+        self.relocated = set()
+
+    def _write(self, name, statement, rows, counter):
+        started = time.perf_counter()
+        for batch in _chunks(rows, self.batch_size):
+            self.connection.execute(statement, batch)
+            self.counts[name][counter] += len(batch)
+        elapsed = time.perf_counter() - started
+        if rows:
+            rate = f" ({len(rows) / elapsed:,.0f} rows/s)" if elapsed > 0 else ''
+            self.log(f"  {name}: {counter} {len(rows):,}{rate}")
+
+    def import_users(self, accounts):
+        """Upsert ``{email: row}`` accounts; returns ``({email: (id, user_type)}, ids of renamed accounts)``."""
+        user = self.tables['user']
+        existing = _lookup(self.connection, user.c.email, [user.c.id, user.c.user_type, user.c.name, user.c.phone],
+                           accounts)
+        new, updates, renamed = [], [], set()
+        for email, row in accounts.items():
+            current = existing.get(email)
+            if current is None:
+                new.append(row)
+                continue
+            # A missing phone leaves the current one in place
+            values = {'name': row['name'], 'phone': row.get('phone') or current.phone}
+            if not _changed(current, values):
+                self.counts['users']['unchanged'] += 1
+                continue
+            updates.append({'user_id': current.id, 'new_name': values['name'], 'new_phone': values['phone']})
+            if current.name != values['name']:
+                renamed.add(current.id)
+
+        plaintext = [row for row in new if not row.get('password_hash') and row.get('password')]
+        if plaintext:
+            started = time.perf_counter()
+            hashes = self.hasher.hash_many([str(row['password']) for row in plaintext])
+            for row, password_hash in zip(plaintext, hashes):
+                row['password_hash'] = password_hash
+            self.log(f"  hashed {len(plaintext):,} passwords in {time.perf_counter() - started:.1f}s")
+
+        self._write('users', user.insert(), [{
+            'email': row['email'], 'password_hash': row.get('password_hash') or UNUSABLE_PASSWORD,
+            'name': row['name'], 'user_type': row['user_type'], 'phone': row.get('phone')
+        } for row in new], 'inserted')
+        self._write('users', _update(user, 'user_id', ('name', 'phone')), updates, 'updated')
+
+        inserted = _lookup(self.connection, user.c.email, [user.c.id, user.c.user_type], [row['email'] for row in new])
+        return {email: (row.id, row.user_type) for email, row in {**existing, **inserted}.items()}, renamed
+
+    def import_hospitals(self, rows, users):
+        """Upsert hospitals by name.
+
+        Returns ``({name: id}, ids inserted or updated, ids whose address or contact changed)``.
+        """
+        hospital = self.tables['hospital']
+        existing = _lookup(self.connection, hospital.c.name,
+                           [hospital.c.id] + [hospital.c[field] for field in HOSPITAL_FIELDS], [row['name'] for row in rows])
+        new, updates, moved, relocated = [], [], set(), []
+        for row in rows:
+            admin = users.get(row.get('admin_email'))
+            if admin is None:
+                self.skipped.append(f"hospital {row['name']!r}: unknown admin {row.get('admin_email')!r}")
+                continue
+            values = {'address': row['address'], 'contact': row.get('contact'),
+                      'description': row.get('description', ''), 'admin_id': admin[0]}
+            current = existing.get(row['name'])
+            if current is None:
+                new.append(dict(values, name=row['name']))
+            elif _changed(current, values):
+                updates.append(dict({f'new_{field}': value for field, value in values.items()}, hospital_id=current.id))
+                if current.address != values['address']:
+                    relocated.append(current.id)
+                if (current.address, current.contact) != (values['address'], values['contact']):
+                    moved.add(current.id)
+            else:
+                self.counts['hospitals']['unchanged'] += 1
+
+        self._write('hospitals', hospital.insert(), new, 'inserted')
+        self._write('hospitals', _update(hospital, 'hospital_id', HOSPITAL_FIELDS), updates, 'updated')
+        inserted = {name: row.id for name, row in
+                    _lookup(self.connection, hospital.c.name, [hospital.c.id], [row['name'] for row in new]).items()}
+        self.geocode(list(inserted.values()) + relocated)
+        ids = {name: row.id for name, row in existing.items()}
+        ids.update(inserted)
+        return ids, set(inserted.values()) | {row['hospital_id'] for row in updates}, moved
+
+    def geocode(self, hospital_ids):
+        """Look up coordinates for new or moved hospitals in geocoder-sized batches."""
+        if self.geocoder is None or not hospital_ids:
+            return
+        hospital = self.tables['hospital']
+        addresses = _lookup(self.connection, hospital.c.id, [hospital.c.address], hospital_ids)
+        statement = hospital.update().where(hospital.c.id == sa.bindparam('hospital_id')).values(
+            latitude=sa.bindparam('lat'), longitude=sa.bindparam('lng'))
+        for batch in _chunks(sorted(addresses), self.geocoder.max_batch):
+            results = self.geocoder.geocode_batch([addresses[hospital_id].address for hospital_id in batch])
+            located = [{'hospital_id': hospital_id, 'lat': point[0], 'lng': point[1]}
+                       for hospital_id, point in zip(batch, results) if point is not None]
+            if located:
+                self.connection.execute(statement, located)
+            self.geocoded += len(located)
+            self.relocated.update(row['hospital_id'] for row in located)
+
+    def import_doctors(self, rows, users, hospital_ids):
+        """Upsert doctor profiles by account.
+
+        Returns ``(ids of doctors inserted or updated, ids of hospitals whose staff changed)``.
+        """
+        doctor = self.tables['doctor']
+        profiles = {}
+        for row in rows:
+            account, hospital_id = users[row['email']], hospital_ids.get(row['hospital_name'])
+            if account[1] != 'doctor':
+                self.skipped.append(f"doctor {row['email']!r}: account exists as {account[1]}")
+            elif hospital_id is None:
+                self.skipped.append(f"doctor {row['email']!r}: hospital {row['hospital_name']!r} was skipped")
+            else:
+                profiles[account[0]] = {'hospital_id': hospital_id, 'specialization': row['specialization'],
+                                        'experience': row.get('experience'), 'consultation_fee': row.get('fee'),
+                                        'about': row.get('about', '')}
+        existing = _lookup(self.connection, doctor.c.user_id,
+                           [doctor.c.id] + [doctor.c[field] for field in DOCTOR_FIELDS], profiles)
+        new, updates, staffed = [], [], set()
+        for user_id, values in profiles.items():
+            current = existing.get(user_id)
+            if current is None:
+                new.append(dict(values, user_id=user_id))
+                staffed.add(values['hospital_id'])
+            elif _changed(current, values):
+                updates.append(dict({f'new_{field}': value for field, value in values.items()}, doctor_id=current.id))
+                # Hospital entries carry doctor counts and specializations
+                if (current.hospital_id, current.specialization) != (values['hospital_id'], values['specialization']):
+                    staffed.update((current.hospital_id, values['hospital_id']))
+            else:
+                self.counts['doctors']['unchanged'] += 1
+
+        self._write('doctors', doctor.insert(), new, 'inserted')
+        self._write('doctors', _update(doctor, 'doctor_id', DOCTOR_FIELDS), updates, 'updated')
+        inserted = _lookup(self.connection, doctor.c.user_id, [doctor.c.id], [row['user_id'] for row in new])
+        return {row.id for row in inserted.values()} | {row['doctor_id'] for row in updates}, staffed
+
+    def refresh_directory(self, hospital_ids, moved_hospital_ids, doctor_ids):
+        """Core writes bypass the session's flush hooks, so the directory is brought up to date here."""
+        started = time.perf_counter()
+        for chunk in _chunks(hospital_ids, IN_CHUNK):
+            directory.refresh(self.connection, self.tables, hospital_ids=chunk)
+        # Doctor entries carry their hospital's address and contact
+        for chunk in _chunks(moved_hospital_ids, IN_CHUNK):
+            directory.refresh(self.connection, self.tables, staff_hospital_ids=chunk)
+        for chunk in _chunks(doctor_ids, IN_CHUNK):
+            directory.refresh(self.connection, self.tables, doctor_ids=chunk)
+        if hospital_ids or doctor_ids or moved_hospital_ids:
+            self.log(f"  directory: refreshed {len(hospital_ids):,} hospitals, {len(doctor_ids):,} doctors "
+                     f"in {time.perf_counter() - started:.1f}s")
+
+    def run(self, data):
+        started = time.perf_counter()
+        hospitals = {row['name']: row for row in data.get('hospitals', [])}
+        hospital = self.tables['hospital']
+        known = set(hospitals) | set(_lookup(self.connection, hospital.c.name, [],
+                                             [row['hospital_name'] for row in data.get('doctors', [])]))
+        doctors = {}
+        for row in data.get('doctors', []):
+            if row['hospital_name'] in known:
+                doctors[row['email']] = row
+            else:
+                # Checked before accounts are created, so no account is left without its profile
+                self.skipped.append(f"doctor {row['email']!r}: unknown hospital {row['hospital_name']!r}")
+        accounts = {row['email']: dict(row) for row in data.get('users', [])}
+        for email, row in doctors.items():
+            accounts[email] = dict(accounts.get(email, {}), **row, user_type='doctor')
+        self.log(f"Importing {len(accounts):,} accounts, {len(hospitals):,} hospitals, {len(doctors):,} doctors "
+                 f"in batches of {self.batch_size:,}")
+
+        users, renamed = self.import_users(accounts)
+        # Hospitals may name an admin whose account is already in the database rather than in this payload
+        admins = {row.get('admin_email') for row in hospitals.values()} - set(users) - {None}
+        user = self.tables['user']
+        users.update({email: (row.id, row.user_type) for email, row in
+                      _lookup(self.connection, user.c.email, [user.c.id, user.c.user_type], admins).items()})
+        hospital_ids, hospitals_changed, hospitals_moved = self.import_hospitals(list(hospitals.values()), users)
+        doctor_ids, staffed = self.import_doctors(list(doctors.values()), users, hospital_ids)
+        doctor = self.tables['doctor']
+        doctor_ids |= {row.id for row in _lookup(self.connection, doctor.c.user_id, [doctor.c.id], renamed).values()}
+        self.refresh_directory(hospitals_changed | staffed, hospitals_moved, doctor_ids)
+
+        elapsed = time.perf_counter() - started
+        self.log(f"✓ Imported in {elapsed:.1f}s" + (f", geocoded {self.geocoded} hospitals" if self.geocoded else ''))
+        for reason in self.skipped[:20]:
+            self.log(f"  ⚠ skipped {reason}")
+        if len(self.skipped) > 20:
+            self.log(f"  ⚠ ... and {len(self.skipped) - 20} more skipped rows")
+        return {'imported': {name: counts['inserted'] for name, counts in self.counts.items()},
+                'updated': {name: counts['updated'] for name, counts in self.counts.items()},
+                'unchanged': {name: counts['unchanged'] for name, counts in self.counts.items()},
+                'skipped': self.skipped, 'geocoded': self.geocoded, 'relocated': sorted(self.relocated),
+                'seconds': round(elapsed, 2)}
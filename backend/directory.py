@@ -0,0 +1,148 @@
+"""
+Hospital and doctor directory: one denormalized, full-text searchable row per hospital and per
+doctor in the directory_entry table, so listings and search never touch the joined tables.
+
+Full-text search uses the database's own index: an FTS5 table kept in sync by triggers on
+SQLite, a generated tsvector column with a GIN index on Postgres and a FULLTEXT index on MySQL.
+Other backends fall back to LIKE.
+"""
+import re
+
+import sqlalchemy as sa
+
+MAX_SEARCH_TOKENS = 8
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS directory_fts USING fts5("
+    "search_text, content='directory_entry', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS directory_entry_ai AFTER INSERT ON directory_entry BEGIN "
+    "INSERT INTO directory_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS directory_entry_ad AFTER DELETE ON directory_entry BEGIN "
+    "INSERT INTO directory_fts(directory_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS directory_entry_au AFTER UPDATE ON directory_entry BEGIN "
+    "INSERT INTO directory_fts(directory_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO directory_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+POSTGRES_FTS_DDL = [
+    "ALTER TABLE directory_entry ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', search_text)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_directory_entry_search ON directory_entry USING gin (search_vector)",
+]
+
+
+def setup_full_text(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_FTS_DDL:
+            connection.execute(sa.text(statement))
+        # Resync in case directory_entry was dropped and recreated under an existing FTS table
+        connection.execute(sa.text("INSERT INTO directory_fts(directory_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_FTS_DDL:
+            connection.execute(sa.text(statement))
+    elif dialect == 'mysql':
+        existing = {index['name'] for index in sa.inspect(connection).get_indexes('directory_entry')}
+        if 'ix_directory_entry_search' not in existing:
+            connection.execute(sa.text("CREATE FULLTEXT INDEX ix_directory_entry_search ON directory_entry (search_text)"))
+
+
+def search_tokens(text):
+    return re.findall(r'\w+', (text or '').lower())[:MAX_SEARCH_TOKENS]
+
+
+def match_clause(dialect, entry, text):
+    """WHERE clause matching entries that contain every word of ``text`` (as prefixes), or None."""
+    tokens = search_tokens(text)
+    if not tokens:
+        return None
+    if dialect == 'sqlite':
+        return entry.c.id.in_(
+            sa.text("SELECT rowid FROM directory_fts WHERE directory_fts MATCH :fts_query")
+            .bindparams(fts_query=' '.join(f'"{token}"*' for token in tokens))
+            .columns(sa.column('rowid', sa.Integer)))
+    if dialect == 'postgresql':
+        return sa.text("directory_entry.search_vector @@ to_tsquery('simple', :ts_query)").bindparams(
+            ts_query=' & '.join(f'{token}:*' for token in tokens))
+    if dialect == 'mysql':
+        return sa.text("MATCH (directory_entry.search_text) AGAINST (:ft_query IN BOOLEAN MODE)").bindparams(
+            ft_query=' '.join(f'+{token}*' for token in tokens))
+    return sa.and_(*(entry.c.search_text.ilike(f'%{token}%') for token in tokens))
+
+
+def _search_text(*parts):
+    return ' '.join(str(part) for part in parts if part)
+
+
+def _doctor_rows(connection, tables, doctor_ids=None, hospital_ids=None):
+    doctor, user, hospital = tables['doctor'], tables['user'], tables['hospital']
+    query = (sa.select(doctor.c.id, doctor.c.hospital_id, user.c.name, hospital.c.name.label('hospital_name'),
+                       hospital.c.address, hospital.c.contact, doctor.c.specialization,
+                       doctor.c.consultation_fee, doctor.c.experience)
+        .join(user, user.c.id == doctor.c.user_id)
+        .join(hospital, hospital.c.id == doctor.c.hospital_id))
+    conditions = []
+    if doctor_ids:
+        conditions.append(doctor.c.id.in_(doctor_ids))
+    if hospital_ids:
+        conditions.append(doctor.c.hospital_id.in_(hospital_ids))
+    if conditions:
+        query = query.where(sa.or_(*conditions))
+    return [{
+        'entry_key': f'd:{row.id}', 'kind': 'doctor', 'hospital_id': row.hospital_id, 'doctor_id': row.id,
+        'name': row.name, 'hospital_name': row.hospital_name, 'address': row.address, 'contact': row.contact,
+        'description': None, 'specialization': row.specialization, 'consultation_fee': row.consultation_fee,
+        'experience': row.experience, 'doctor_count': None,
+        'search_text': _search_text(row.name, row.specialization, row.hospital_name, row.address)
+    } for row in connection.execute(query)]
+
+
+def _hospital_rows(connection, tables, hospital_ids=None):
+    hospital, doctor = tables['hospital'], tables['doctor']
+    query = sa.select(hospital.c.id, hospital.c.name, hospital.c.address, hospital.c.contact, hospital.c.description)
+    staff = (sa.select(doctor.c.hospital_id, doctor.c.specialization, sa.func.count(doctor.c.id))
+        .group_by(doctor.c.hospital_id, doctor.c.specialization))
+    if hospital_ids:
+        query = query.where(hospital.c.id.in_(hospital_ids))
+        staff = staff.where(doctor.c.hospital_id.in_(hospital_ids))
+    counts, specializations = {}, {}
+    for hospital_id, specialization, count in connection.execute(staff):
+        counts[hospital_id] = counts.get(hospital_id, 0) + count
+        specializations.setdefault(hospital_id, []).append(specialization)
+    return [{
+        'entry_key': f'h:{row.id}', 'kind': 'hospital', 'hospital_id': row.id, 'doctor_id': None,
+        'name': row.name, 'hospital_name': row.name, 'address': row.address, 'contact': row.contact,
+        'description': row.description, 'specialization': None, 'consultation_fee': None, 'experience': None,
+        'doctor_count': counts.get(row.id, 0),
+        # Offered specializations make "cardiologist hyderabad" find hospitals too
+        'search_text': _search_text(row.name, row.address, *sorted(specializations.get(row.id, [])))
+    } for row in connection.execute(query)]
+
+
+def refresh(connection, tables, hospital_ids=(), doctor_ids=(), staff_hospital_ids=()):
+    """Rewrite the entries of the given hospitals and doctors, plus every doctor of ``staff_hospital_ids``."""
+    entry = tables['directory_entry']
+    hospital_ids, doctor_ids, staff_hospital_ids = set(hospital_ids), set(doctor_ids), set(staff_hospital_ids)
+    rows = []
+    if hospital_ids:
+        connection.execute(entry.delete().where(entry.c.kind == 'hospital', entry.c.hospital_id.in_(hospital_ids)))
+        rows += _hospital_rows(connection, tables, hospital_ids)
+    if doctor_ids or staff_hospital_ids:
+        conditions = []
+        if doctor_ids:
+            conditions.append(entry.c.doctor_id.in_(doctor_ids))
+        if staff_hospital_ids:
+            conditions.append(entry.c.hospital_id.in_(staff_hospital_ids))
+        connection.execute(entry.delete().where(entry.c.kind == 'doctor', sa.or_(*conditions)))
+        rows += _doctor_rows(connection, tables, doctor_ids, staff_hospital_ids)
+    if rows:
+        connection.execute(entry.insert(), rows)
+
+
+def rebuild(connection, tables, batch_size=5000):
+    """Recreate the whole directory from the hospital, doctor and user tables. Returns the entry count."""
+    entry = tables['directory_entry']
+    connection.execute(entry.delete())
+    rows = _hospital_rows(connection, tables) + _doctor_rows(connection, tables)
+    for start in range(0, len(rows), batch_size):
+        connection.execute(entry.insert(), rows[start:start + batch_size])
+    return len(rows)
@@ -0,0 +1,212 @@
+"""
+Ambulance dispatch: assign the nearest available unit to each booking.
+
+Available units' live positions sit in a per-process grid index (cells of a fixed number of
+degrees), which takes position updates in O(1) and finds the nearest units by searching outward
+ring by ring. The index only proposes candidates: a unit is claimed with a conditional UPDATE
+that requires it to still be available, so concurrent dispatchers, in this worker or another,
+can never assign the same unit twice. Units a local dispatcher is busy claiming are skipped by
+the others, which keeps a surge of requests from one area from all racing for the same unit.
+
+Requests go through a ``DispatchQueue``: one thread per process stores and assigns whatever
+has queued up in a single transaction, so a surge costs one commit per batch instead of one per
+request.
+"""
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from geo import haversine_km
+
+KM_PER_DEGREE = 111.32
+
+
+class GridIndex:
+    """Moving points bucketed into lat/lng cells, with nearest-k search."""
+
+    def __init__(self, cell_degrees=0.1):
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def move(self, key, lat, lng):
+        self.remove(key)
+        cell = self._cell(lat, lng)
+        self.cells.setdefault(cell, {})[key] = (lat, lng)
+        self.positions[key] = cell
+
+    def remove(self, key):
+        cell = self.positions.pop(key, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self.cells[cell]
+
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for offset in range(-radius, radius + 1):
+            yield (row - radius, col + offset)
+            yield (row + radius, col + offset)
+        for offset in range(-radius + 1, radius):
+            yield (row + offset, col - radius)
+            yield (row + offset, col + radius)
+
+    def _ring_clearance_km(self, lat, radius):
+        """Lower bound on the distance from the query point to anything beyond ``radius`` rings."""
+        # Longitude cells narrow away from the equator; use the narrowest within reach
+        widest_lat = min(89.9, abs(lat) + (radius + 1) * self.cell_degrees)
+        return radius * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+    def nearest(self, lat, lng, k=1, max_km=None, skip=()):
+        """Up to ``k`` ``(key, distance_km)`` pairs, closest first, leaving out keys in ``skip``."""
+        found = []
+        center = self._cell(lat, lng)
+        scanned, radius = 0, 0
+        while True:
+            if scanned >= len(self.cells):
+                break
+            if 8 * radius > len(self.cells):
+                # The ring is larger than the occupied cells: scan what is left directly
+                found = [(haversine_km(lat, lng, *point), key) for bucket in self.cells.values()
+                         for key, point in bucket.items() if key not in skip]
+                break
+            for cell in self._ring(center, radius):
+                bucket = self.cells.get(cell)
+                if bucket:
+                    scanned += 1
+                    found.extend((haversine_km(lat, lng, *point), key) for key, point in bucket.items()
+                                 if key not in skip)
+            clearance = self._ring_clearance_km(lat, radius)
+            if max_km is not None and clearance > max_km:
+                break
+            if len(found) >= k and sorted(found)[k - 1][0] <= clearance:
+                break
+            radius += 1
+        found.sort()
+        return [(key, distance) for distance, key in found[:k] if max_km is None or distance <= max_km]
+
+
+class Dispatcher:
+    """Per-process fleet index plus the claim loop that turns a pickup point into an assigned unit."""
+
+    def __init__(self, load_available, refresh_seconds=5.0, cell_degrees=0.1, max_attempts=8):
+        self.load_available = load_available
+        self.refresh_seconds = refresh_seconds
+        self.cell_degrees = cell_degrees
+        self.max_attempts = max_attempts
+        self.index = GridIndex(cell_degrees)
+        self.loaded_at = None
+        self._reserved = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Reload available units from the database when stale; other workers' changes arrive this way."""
+        if not force and self.loaded_at is not None and time.monotonic() - self.loaded_at < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=self.loaded_at is None or force):
+            return
+        try:
+            index = GridIndex(self.cell_degrees)
+            for unit_id, lat, lng in self.load_available():
+                index.move(unit_id, lat, lng)
+            with self._lock:
+                self.index, self.loaded_at = index, time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def update(self, unit_id, lat=None, lng=None, available=True):
+        with self._lock:
+            if available and lat is not None and lng is not None:
+                self.index.move(unit_id, lat, lng)
+            else:
+                self.index.remove(unit_id)
+
+    def assign(self, lat, lng, claim, max_km=None):
+        """Claim the nearest available unit with ``claim(unit_id) -> bool``.
+
+        Returns ``(unit_id, distance_km)``, or None when no unit within ``max_km`` could be claimed.
+        """
+        self.refresh()
+        for _ in range(self.max_attempts):
+            with self._lock:
+                nearest = self.index.nearest(lat, lng, 1, max_km, skip=self._reserved)
+                if not nearest:
+                    return None
+                unit_id, distance = nearest[0]
+                self._reserved.add(unit_id)
+            try:
+                claimed = claim(unit_id)
+            finally:
+                with self._lock:
+                    self._reserved.discard(unit_id)
+                    # Either ours now or taken by another worker: not available any more
+                    self.index.remove(unit_id)
+            if claimed:
+                return unit_id, distance
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'available_units': len(self.index), 'claiming': len(self._reserved),
+                    'age_seconds': round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None}
+
+
+class DispatchQueue:
+    """Feeds submitted items to ``process(items) -> results`` in batches on a single background thread."""
+
+    def __init__(self, process, max_batch=100):
+        self.process = process
+        self.max_batch = max_batch
+        self.batches = 0
+        self._pending = deque()
+        self._wakeup = threading.Condition()
+        self._thread = None
+
+    def submit(self, item):
+        """Queue ``item``; the returned future resolves to its result once its batch is committed."""
+        future = Future()
+        with self._wakeup:
+            self._pending.append((item, future))
+            # Started lazily, so each forked worker gets its own thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ambulance-dispatch', daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._pending:
+                    self._wakeup.wait()
+                batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+            self.batches += 1
+            try:
+                results = self.process([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+    def depth(self):
+        return len(self._pending)
+
+
+def eta_minutes(distance_km, speed_kmh, road_factor=1.4, turnout_minutes=2.0):
+    """Travel estimate: straight-line distance stretched to road distance, plus the time to get rolling."""
+    return turnout_minutes + distance_km * road_factor / speed_kmh * 60
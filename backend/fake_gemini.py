@@ -0,0 +1,60 @@
+"""
+Local stand-in for the Gemini GenerativeModel, for tests, load tests and offline development.
+Enable it with GEMINI_FAKE=1; GEMINI_FAKE_LATENCY adds a simulated generation delay in seconds.
+"""
+import time
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    @property
+    def text(self):
+        return ''.join(chunk.text for chunk in self._chunks)
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+class FakeGenerativeModel:
+    """Mimics ``generate_content`` (blocking and ``stream=True``) without any network calls."""
+
+    def __init__(self, latency=0.0, words_per_chunk=8, reply=None):
+        self.latency = latency
+        self.words_per_chunk = words_per_chunk
+        self.reply = reply
+        self.calls = 0
+
+    def _reply_for(self, contents):
+        if self.reply is not None:
+            return self.reply
+        message = str(contents).rsplit('User message: ', 1)[-1].strip()
+        return (f"## Understanding {message}:\n"
+                f"- This is a local test response for \"{message}\".\n\n"
+                "⚠️ Please consult with a doctor before taking any medication.")
+
+    def _chunks(self, text):
+        words = text.split(' ')
+        size = self.words_per_chunk
+        return [FakeChunk(' '.join(words[i:i + size]) + (' ' if i + size < len(words) else ''))
+                for i in range(0, len(words), size)]
+
+    def _stream(self, chunks):
+        delay = self.latency / len(chunks) if chunks else 0
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        chunks = self._chunks(self._reply_for(contents))
+        if stream:
+            return self._stream(chunks)
+        time.sleep(self.latency)
+        return FakeResponse(chunks)
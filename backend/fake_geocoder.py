@@ -0,0 +1,56 @@
+"""
+Local stand-in for a batch geocoding service, for the hospital coordinate backfill, seeding and
+offline development. It recognises the city in an address and places the address at a stable
+point within a few kilometres of that city's centre; GEOCODER_FAKE_LATENCY adds a simulated
+delay per batch in seconds.
+"""
+import hashlib
+import math
+import re
+import time
+
+# City centres (latitude, longitude)
+CITIES = {
+    'ahmedabad': (23.0225, 72.5714), 'bengaluru': (12.9716, 77.5946), 'bangalore': (12.9716, 77.5946),
+    'bhopal': (23.2599, 77.4126), 'bhubaneswar': (20.2961, 85.8245), 'chandigarh': (30.7333, 76.7794),
+    'chennai': (13.0827, 80.2707), 'coimbatore': (11.0168, 76.9558), 'delhi': (28.6139, 77.2090),
+    'guwahati': (26.1445, 91.7362), 'hyderabad': (17.3850, 78.4867), 'indore': (22.7196, 75.8577),
+    'jaipur': (26.9124, 75.7873), 'kochi': (9.9312, 76.2673), 'kolkata': (22.5726, 88.3639),
+    'lucknow': (26.8467, 80.9462), 'madurai': (9.9252, 78.1198), 'mumbai': (19.0760, 72.8777),
+    'nagpur': (21.1458, 79.0882), 'patna': (25.5941, 85.1376), 'pune': (18.5204, 73.8567),
+    'secunderabad': (17.4399, 78.4983), 'surat': (21.1702, 72.8311), 'thiruvananthapuram': (8.5241, 76.9366),
+    'vadodara': (22.3072, 73.1812), 'visakhapatnam': (17.6868, 83.2185), 'warangal': (17.9689, 79.5941),
+}
+SPREAD_KM = 8.0
+
+
+class LocalGeocoder:
+    """Mimics a batch geocoding API: ``geocode_batch(addresses)`` returns a ``(lat, lng)`` or None each."""
+
+    max_batch = 100
+
+    def __init__(self, latency=0.0, spread_km=SPREAD_KM):
+        self.latency = latency
+        self.spread_km = spread_km
+        self.calls = 0
+
+    def geocode(self, address):
+        words = re.findall(r'[a-z]+', (address or '').lower())
+        # The city usually comes last in an address
+        city = next((word for word in reversed(words) if word in CITIES), None)
+        if city is None:
+            return None
+        lat, lng = CITIES[city]
+        digest = hashlib.sha256(address.strip().lower().encode()).digest()
+        bearing = int.from_bytes(digest[:4], 'big') / 2 ** 32 * 2 * math.pi
+        distance = math.sqrt(int.from_bytes(digest[4:8], 'big') / 2 ** 32) * self.spread_km
+        return (round(lat + distance / 111.32 * math.cos(bearing), 6),
+                round(lng + distance / (111.32 * math.cos(math.radians(lat))) * math.sin(bearing), 6))
+
+    def geocode_batch(self, addresses):
+        if len(addresses) > self.max_batch:
+            raise ValueError(f"At most {self.max_batch} addresses per batch")
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.geocode(address) for address in addresses]
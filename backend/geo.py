@@ -0,0 +1,183 @@
+"""
+Nearest-hospital lookups.
+
+Hospital coordinates are turned into 3D unit vectors and indexed in a KD-tree, so distances are
+straight chords through the sphere: no special cases at the poles or the antimeridian, and the
+chord orders points exactly like the great-circle distance. ``HospitalLocator`` keeps one tree
+per process, rebuilt from the database when it goes stale or hospitals change.
+"""
+import heapq
+import math
+import threading
+import time
+
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 16
+
+
+def unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lng), cos_lat * math.sin(lng), math.sin(lat))
+
+
+def chord_to_km(chord_squared):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+def km_to_chord_squared(km):
+    return (2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)) ** 2
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    dlat, dlng = math.radians(lat2 - lat1), math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def run_cpu_bound(fn, *args):
+    """``fn(*args)``; under gevent on one of the hub's OS threads, so the worker's other requests keep running."""
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return fn(*args)
+    if not monkey.is_module_patched('threading'):
+        return fn(*args)
+    return get_hub().threadpool.apply(fn, args)
+
+
+class KDTree:
+    """Static KD-tree over ``(key, lat, lng)`` points answering k-nearest queries."""
+
+    def __init__(self, points):
+        self.keys = [key for key, _, _ in points]
+        self.vectors = [unit_vector(lat, lng) for _, lat, lng in points]
+        self.axes = list(zip(*self.vectors)) if self.vectors else []
+        # Node: (box, indexes) for leaves, (box, low, high) for branches; box = (mins, maxs)
+        self.root = self._build(list(range(len(self.keys)))) if self.keys else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self, indexes):
+        mins, maxs = [], []
+        for coordinates in self.axes:
+            values = [coordinates[i] for i in indexes]
+            mins.append(min(values))
+            maxs.append(max(values))
+        box = (tuple(mins), tuple(maxs))
+        if len(indexes) <= LEAF_SIZE:
+            return (box, indexes)
+        # Split on the axis with the widest spread
+        spreads = [high - low for low, high in zip(mins, maxs)]
+        coordinates = self.axes[spreads.index(max(spreads))]
+        indexes.sort(key=coordinates.__getitem__)
+        middle = len(indexes) // 2
+        return (box, self._build(indexes[:middle]), self._build(indexes[middle:]))
+
+    @staticmethod
+    def _box_distance(box, target):
+        """Squared distance from ``target`` to the closest point of ``box``."""
+        distance = 0.0
+        for low, high, value in zip(box[0], box[1], target):
+            if value < low:
+                distance += (low - value) ** 2
+            elif value > high:
+                distance += (value - high) ** 2
+        return distance
+
+    def nearest(self, lat, lng, k=5, max_km=None):
+        """Up to ``k`` ``(key, distance_km)`` pairs, closest first."""
+        if self.root is None or k <= 0:
+            return []
+        target = unit_vector(lat, lng)
+        tx, ty, tz = target
+        limit = km_to_chord_squared(max_km) if max_km is not None else float('inf')
+        best = []  # max-heap of (-distance, index) holding the k closest so far
+        stack = [(self._box_distance(self.root[0], target), self.root)]
+        vectors = self.vectors
+        while stack:
+            bound, node = stack.pop()
+            if bound > (-best[0][0] if len(best) == k else limit):
+                continue
+            if len(node) == 2:
+                for i in node[1]:
+                    vx, vy, vz = vectors[i]
+                    distance = (vx - tx) ** 2 + (vy - ty) ** 2 + (vz - tz) ** 2
+                    if distance > limit:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, i))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, i))
+                continue
+            low, high = node[1], node[2]
+            low_bound, high_bound = self._box_distance(low[0], target), self._box_distance(high[0], target)
+            # Push the farther child first so the closer one is searched first
+            if low_bound <= high_bound:
+                stack.append((high_bound, high))
+                stack.append((low_bound, low))
+            else:
+                stack.append((low_bound, low))
+                stack.append((high_bound, high))
+        return [(self.keys[i], chord_to_km(-negative)) for negative, i in sorted(best, reverse=True)]
+
+
+class HospitalLocator:
+    """Per-process KD-tree of hospital coordinates with a stale-while-rebuilding refresh."""
+
+    def __init__(self, load, max_age=300):
+        self.load = load
+        self.max_age = max_age
+        self.tree = None
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self.rebuilding = False
+        self._build_lock = threading.Lock()
+
+    def invalidate(self):
+        """Hospital coordinates changed: rebuild on next use, serving the current tree until then."""
+        self.built_at = 0.0
+
+    def fresh(self):
+        return self.tree is not None and time.monotonic() - self.built_at < self.max_age
+
+    def current(self):
+        """The tree. Only the first build blocks; later ones run in the background and serve the old tree meanwhile."""
+        if self.fresh():
+            return self.tree
+        if self.tree is None:
+            with self._build_lock:
+                if self.tree is None:
+                    self._build()
+            return self.tree
+        with self._build_lock:
+            start = not self.rebuilding and not self.fresh()
+            self.rebuilding = self.rebuilding or start
+        if start:
+            threading.Thread(target=self._rebuild, name='hospital-index', daemon=True).start()
+        return self.tree
+
+    def _build(self):
+        started = time.perf_counter()
+        points = self.load()
+        self.tree, self.built_at = run_cpu_bound(KDTree, points), time.monotonic()
+        self.build_seconds = time.perf_counter() - started
+
+    def _rebuild(self):
+        try:
+            self._build()
+        except Exception as e:
+            # Keep serving the old tree; the next lookup tries again
+            print(f"⚠ Hospital index rebuild failed: {e}")
+        finally:
+            with self._build_lock:
+                self.rebuilding = False
+
+    def nearest(self, lat, lng, k=5, max_km=None):
+        return self.current().nearest(lat, lng, k, max_km)
+
+    def stats(self):
+        return {'hospitals': len(self.tree) if self.tree is not None else 0,
+                'age_seconds': round(time.monotonic() - self.built_at, 1) if self.tree is not None else None,
+                'build_ms': round(self.build_seconds * 1000, 1)}
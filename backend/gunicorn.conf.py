@@ -0,0 +1,53 @@
+"""
+Gunicorn settings, picked up automatically when gunicorn starts in the backend directory.
+
+gevent workers multiplex many slow requests (streamed AI chat in particular) on one process,
+so long LLM calls no longer pin a worker each. Set GUNICORN_WORKER_CLASS=sync to opt out.
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR, which must be set
+before the app (and prometheus_client) is imported, so it is set here in the master. Likewise
+SESSION_STORE_PATH, the SQLite file through which workers share logged-in sessions, and
+PASSWORD_HASH_WORKERS, which splits the CPUs between the workers' password hashing pools.
+"""
+import os
+import shutil
+
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/clinic-prometheus')
+# Server-side sessions shared by this host's workers (and kept across restarts)
+os.environ.setdefault('SESSION_STORE_PATH', '/tmp/clinic-sessions.db')
+# Each worker starts its own password hashing pool; together they get about one process per CPU
+os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+
+def on_starting(server):
+    # Samples left by a previous run's workers would otherwise be counted again
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 is a C driver; without this every Postgres query would block the whole worker
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    from app import warm_db_pool, warm_hospital_index
+    opened = warm_db_pool()
+    if opened:
+        worker.log.info("Warmed %s database connections", opened)
+    indexed = warm_hospital_index()
+    if indexed:
+        worker.log.info("Indexed %s hospital locations", indexed)
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
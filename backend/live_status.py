@@ -0,0 +1,115 @@
+"""
+Live ambulance booking status for server-sent event streams.
+
+``StatusHub`` keeps one watcher thread per process. However many clients follow a booking, the
+watcher reads the state of every watched booking with one query per tick and fans each change
+out to all of that booking's subscribers. Changes committed in this process wake the watcher
+immediately; changes committed by other workers show up within one poll interval.
+"""
+import threading
+import time
+
+
+class Subscription:
+    """One client's view of a key: holds only the newest state it has not seen yet."""
+
+    def __init__(self, key, state=None):
+        self.key = key
+        self._state = state
+        self._pending = state is not None
+        self._changed = threading.Condition()
+
+    def put(self, state):
+        with self._changed:
+            self._state, self._pending = state, True
+            self._changed.notify()
+
+    def get(self, timeout=None):
+        """The next unseen state, or None if nothing changed within ``timeout`` seconds."""
+        with self._changed:
+            if not self._pending:
+                self._changed.wait(timeout)
+            if not self._pending:
+                return None
+            self._pending = False
+            return self._state
+
+
+class StatusHub:
+    """Fans out state changes for watched keys, polling ``load(keys) -> {key: state}`` for them."""
+
+    def __init__(self, load, interval=2.0, chunk_size=500):
+        self.load = load
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.polls = 0
+        self._subscribers = {}
+        self._states = {}
+        self._poked = False
+        self._wakeup = threading.Condition()
+        self._thread = None
+
+    def subscribe(self, key, state):
+        """Follow ``key``, starting from ``state`` (which the caller just read); the first get() returns it."""
+        subscription = Subscription(key, state)
+        with self._wakeup:
+            self._subscribers.setdefault(key, set()).add(subscription)
+            self._states.setdefault(key, state)
+            # Started lazily, so each forked worker gets its own thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='status-hub', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._wakeup:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+                    self._states.pop(subscription.key, None)
+
+    def notify(self):
+        """Something watched may have changed in this process: poll now rather than at the next tick."""
+        with self._wakeup:
+            self._poked = True
+            self._wakeup.notify()
+
+    def current(self, key):
+        """Latest known state of a watched key, or None when nobody is watching it."""
+        with self._wakeup:
+            return self._states.get(key)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._poked:
+                    self._wakeup.wait(self.interval)
+                self._poked = False
+                keys = list(self._subscribers)
+            if not keys:
+                continue
+            states = {}
+            try:
+                for start in range(0, len(keys), self.chunk_size):
+                    states.update(self.load(keys[start:start + self.chunk_size]))
+            except Exception as e:
+                print(f"⚠ Status hub poll failed: {e}")
+                time.sleep(self.interval)
+                continue
+            self.polls += 1
+            with self._wakeup:
+                for key, state in states.items():
+                    subscribers = self._subscribers.get(key)
+                    if subscribers is None or self._states.get(key) == state:
+                        continue
+                    self._states[key] = state
+                    for subscription in subscribers:
+                        subscription.put(state)
+
+    def stats(self):
+        with self._wakeup:
+            return {'watched': len(self._subscribers),
+                    'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                    'polls': self.polls}
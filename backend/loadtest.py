@@ -0,0 +1,335 @@
+"""
+Load-test harness that drives the real routes with a mix of patients, doctors and hospital admins.
+
+Seed a database with seed_data.py first, then either run against a server (start it with
+GEMINI_FAKE=1 so /api/chat hits the local stub model instead of Gemini):
+
+    GEMINI_FAKE=1 GEMINI_FAKE_LATENCY=0.5 gunicorn -c gunicorn.conf.py wsgi:app
+    python loadtest.py --base-url http://localhost:8000 --profile small --users 50 --duration 60
+
+or in-process through the Flask test client, which needs no server:
+
+    python loadtest.py --in-process --database-url sqlite:///loadtest.db --profile small --users 8
+
+Throughput and p50/p95/p99 latency are reported per route. --json saves them, and --baseline
+compares against an earlier run and exits non-zero when a route regressed beyond --tolerance.
+--emergency-users adds users who only book ambulances, alongside the others; --emergency-p99-ms
+then fails the run when the emergency route's p99 exceeds it.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from seed_data import DEFAULT_PASSWORD, PROFILES, WORK_DAYS, WORK_END_HOUR, WORK_START_HOUR, profile_counts, user_email
+
+CHAT_MESSAGES = [
+    'I have a headache and mild fever',
+    'What should I do for a sore throat?',
+    'Which doctor should I see for chest pain?',
+    'I have back pain after lifting something heavy',
+    'How do I book an appointment?',
+    'My child has a cough and cold',
+    'What are the symptoms of dehydration?',
+    'I feel dizzy when I stand up',
+    'Is it safe to take paracetamol twice a day?',
+    'I have a skin rash on my arm',
+]
+SLOT_BUTTON = re.compile(r'data-date="([0-9-]+)"\s+data-time="([0-9:]+)"')
+ROLE_WEIGHTS = {'patient': 80, 'doctor': 15, 'admin': 5}
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    """One browser session against a running server: its own cookie jar, redirects not followed."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.headers.get('Location', ''), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Location', ''), e.read()
+
+
+class FlaskClient:
+    """Same interface as HttpClient, served in-process by the Flask test client."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self.client.open(path, method=method, data=form, json=json_body)
+        return response.status_code, response.headers.get('Location', ''), response.get_data()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.shed = {}
+        self.recording = False
+
+    def record(self, route, elapsed, ok, status=None):
+        if not self.recording:
+            return
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status == 503:
+                # Turned away by admission control: counted apart from failures
+                self.shed[route] = self.shed.get(route, 0) + 1
+            elif not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    # Nearest-rank percentile
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(recorder, duration):
+    results = {}
+    for route, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        results[route] = {
+            'requests': len(ordered),
+            'errors': recorder.errors.get(route, 0),
+            'shed': recorder.shed.get(route, 0),
+            'rps': round(len(ordered) / duration, 2),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+            'max_ms': round(ordered[-1] * 1000, 2),
+        }
+    return results
+
+
+def print_table(results):
+    print(f"{'route':<34} {'requests':>9} {'errors':>7} {'shed':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}")
+    for route, row in results.items():
+        print(f"{route:<34} {row['requests']:>9} {row['errors']:>7} {row.get('shed', 0):>6} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Routes whose p95 grew or whose throughput dropped by more than ``tolerance`` (a fraction)."""
+    regressions = []
+    for route, row in results.items():
+        before = baseline.get(route)
+        if not before:
+            continue
+        if before['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {before['p95_ms']:.1f}ms -> {row['p95_ms']:.1f}ms")
+        if before['rps'] and row['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {before['rps']:.1f} -> {row['rps']:.1f} req/s")
+    return regressions
+
+
+class VirtualUser(threading.Thread):
+    """Loops login -> role-specific pages until the deadline, each iteration as a fresh session."""
+
+    def __init__(self, number, options, make_client, recorder, deadline, emergency=False):
+        super().__init__(daemon=True)
+        self.emergency = emergency
+        self.options = options
+        self.make_client = make_client
+        self.recorder = recorder
+        self.deadline = deadline
+        self.rng = random.Random(options.seed + number)
+
+    def call(self, route, method, path, ok=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            status, location, body = self.client.request(method, path, **kwargs)
+            passed = ok(status, location, body) if ok else status == 200
+        except Exception as e:
+            status, location, body, passed = 0, '', str(e).encode(), False
+        self.recorder.record(route, time.perf_counter() - started, passed, status)
+        if self.options.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.options.think_time))
+        return passed, status, location, body
+
+    def login(self, role, user_type):
+        number = self.rng.randint(1, self.options.counts[{'admin': 'hospitals', 'doctor': 'doctors',
+                                                          'patient': 'patients'}[role]])
+        passed, *_ = self.call('POST /login', 'POST', '/login', form={
+            'email': user_email(role, number), 'password': self.options.password, 'user_type': user_type
+        }, ok=lambda status, location, body: status == 302 and '/login' not in location)
+        return passed
+
+    def pick_slot(self, page):
+        """A free slot offered on the booking page, or a random grid time when none is listed."""
+        offered = SLOT_BUTTON.findall(page.decode('utf-8', 'replace'))
+        if offered:
+            return self.rng.choice(offered)
+        step = timedelta(minutes=self.options.slot_minutes)
+        per_day = int((WORK_END_HOUR - WORK_START_HOUR) * 60 / self.options.slot_minutes)
+        today = datetime.now().date()
+        while True:
+            day = today + timedelta(days=self.rng.randint(1, self.options.horizon_days - 1))
+            if day.weekday() in WORK_DAYS:
+                slot = datetime(day.year, day.month, day.day, WORK_START_HOUR) + step * self.rng.randrange(per_day)
+                return slot.strftime('%Y-%m-%d'), slot.strftime('%H:%M')
+
+    def patient(self):
+        if not self.login('patient', 'patient'):
+            return
+        self.call('GET /patient/dashboard', 'GET', '/patient/dashboard')
+        doctor_id = self.rng.randint(1, self.options.counts['doctors'])
+        _, _, _, page = self.call('GET /book_appointment/<id>', 'GET', f'/book_appointment/{doctor_id}')
+        slot_date, slot_time = self.pick_slot(page)
+        # A taken slot redirects back to the booking page; only the dashboard redirect means booked
+        self.call('POST /book_appointment/<id>', 'POST', f'/book_appointment/{doctor_id}', form={
+            'appointment_date': slot_date, 'appointment_time': slot_time,
+            'symptoms': 'Load test booking'
+        }, ok=lambda status, location, body: status == 302 and '/patient/dashboard' in location)
+        self.call('POST /api/chat', 'POST', '/api/chat', json_body={'message': self.rng.choice(CHAT_MESSAGES)})
+        if self.rng.random() < self.options.ambulance_rate:
+            self.book_ambulance()
+
+    def book_ambulance(self):
+        self.call('POST /emergency/ambulance/book', 'POST', '/emergency/ambulance/book', form={
+            'patient_name': 'Load Test Patient', 'phone': '9000000000',
+            'pickup_address': 'Load Test Street', 'pickup_lat': '17.385', 'pickup_lng': '78.4867',
+            'emergency_type': 'Accident', 'patient_condition': 'Conscious'
+        })
+
+    def emergency_caller(self):
+        if self.login('patient', 'patient'):
+            self.book_ambulance()
+            time.sleep(self.rng.uniform(0, 2 * self.options.emergency_interval))
+
+    def doctor(self):
+        if self.login('doctor', 'doctor'):
+            self.call('GET /doctor/dashboard', 'GET', '/doctor/dashboard')
+
+    def admin(self):
+        if self.login('admin', 'hospital_admin'):
+            self.call('GET /hospital/dashboard', 'GET', '/hospital/dashboard')
+
+    def run(self):
+        roles, weights = zip(*ROLE_WEIGHTS.items())
+        while time.monotonic() < self.deadline:
+            self.client = self.make_client()
+            if self.emergency:
+                self.emergency_caller()
+            else:
+                getattr(self, self.rng.choices(roles, weights)[0])()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--base-url', help='server to test, e.g. http://localhost:8000')
+    target.add_argument('--in-process', action='store_true', help='serve requests with the Flask test client')
+    parser.add_argument('--database-url', help='database for --in-process (defaults to DATABASE_URL)')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small', help='profile the data was seeded with')
+    for name in ('hospitals', 'doctors', 'patients'):
+        parser.add_argument(f'--{name}', type=int, help=f'override the profile\'s number of {name}')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before measuring')
+    parser.add_argument('--think-time', type=float, default=0, help='mean pause between requests in seconds')
+    parser.add_argument('--ambulance-rate', type=float, default=0.1, help='share of patient sessions booking an ambulance')
+    parser.add_argument('--emergency-users', type=int, default=0, help='extra users who only book ambulances')
+    parser.add_argument('--emergency-interval', type=float, default=1.0, help='mean pause between their bookings')
+    parser.add_argument('--emergency-p99-ms', type=float, help='fail when ambulance booking p99 exceeds this')
+    parser.add_argument('--slot-minutes', type=int, default=int(os.getenv('SLOT_MINUTES', 30)))
+    parser.add_argument('--horizon-days', type=int, default=int(os.getenv('SLOT_HORIZON_DAYS', 30)))
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression as a fraction')
+    options = parser.parse_args()
+    options.counts = profile_counts(options)
+    return options
+
+
+def main():
+    options = parse_args()
+    if options.in_process:
+        if options.database_url:
+            os.environ['DATABASE_URL'] = options.database_url
+        os.environ.setdefault('SECRET_KEY', 'loadtest')
+        os.environ.setdefault('GEMINI_FAKE', '1')
+        from app import app
+        make_client = lambda: FlaskClient(app)
+    else:
+        make_client = lambda: HttpClient(options.base_url, options.timeout)
+
+    recorder = Recorder()
+    deadline = time.monotonic() + options.warmup + options.duration
+    users = [VirtualUser(number, options, make_client, recorder, deadline) for number in range(options.users)]
+    users += [VirtualUser(options.users + number, options, make_client, recorder, deadline, emergency=True)
+              for number in range(options.emergency_users)]
+    print(f"Running {options.users} virtual users and {options.emergency_users} emergency callers: "
+          f"{options.warmup:.0f}s warmup, {options.duration:.0f}s measured")
+    for user in users:
+        user.start()
+    time.sleep(options.warmup)
+    recorder.recording = True
+    started = time.monotonic()
+    for user in users:
+        user.join()
+    recorder.recording = False
+    results = summarize(recorder, time.monotonic() - started)
+    print_table(results)
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'options': {'users': options.users, 'duration': options.duration, 'profile': options.profile},
+                       'routes': results}, f, indent=2)
+        print(f"✓ Results written to {options.json}")
+    failed = False
+    if options.emergency_p99_ms is not None:
+        emergency = results.get('POST /emergency/ambulance/book')
+        p99 = emergency['p99_ms'] if emergency else float('inf')
+        failed = p99 > options.emergency_p99_ms
+        print(f"{'✗' if failed else '✓'} Ambulance booking p99 {p99:.1f}ms (limit {options.emergency_p99_ms:.0f}ms)")
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f)['routes'], options.tolerance)
+        for line in regressions:
+            print(f"✗ Regression: {line}")
+        if regressions:
+            failed = True
+        else:
+            print(f"✓ No route regressed more than {options.tolerance:.0%} against {options.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
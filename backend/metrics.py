@@ -0,0 +1,100 @@
+"""
+Prometheus metrics for the clinic app, served at /metrics.
+
+Under gunicorn every worker is its own process, so when PROMETHEUS_MULTIPROC_DIR is set
+(gunicorn.conf.py sets it) each worker writes its samples to memory-mapped files in that
+directory and /metrics aggregates the files of all workers.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Request latencies in seconds; AI calls are much slower, so they get their own buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+GEMINI_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+POOL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests served', ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to produce the response',
+                            ['method', 'endpoint'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests currently being handled', multiprocess_mode='livesum')
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Pooled connections checked out by requests',
+                    multiprocess_mode='livesum')
+POOL_CHECKOUT_WAIT = Histogram('db_pool_checkout_seconds', 'Time spent getting a connection from the pool',
+                               buckets=POOL_BUCKETS)
+GEMINI_LATENCY = Histogram('gemini_request_duration_seconds', 'Gemini generate_content calls, start to last chunk',
+                           ['mode'], buckets=GEMINI_BUCKETS)
+GEMINI_ERRORS = Counter('gemini_errors_total', 'Failed Gemini calls', ['mode', 'kind'])
+GEMINI_SHED = Counter('gemini_shed_total', 'Chat requests answered without calling Gemini', ['reason'])
+REPLICA_ROUTING = Counter('db_replica_routing_total', 'Read-only requests by the database they read from',
+                          ['target', 'reason'])
+REPLICA_LAG = Gauge('db_replica_lag_seconds', 'Last measured replication lag', ['replica'], multiprocess_mode='max')
+BOOKINGS = Counter('appointment_bookings_total', 'Appointment booking attempts by outcome', ['outcome'])
+AMBULANCE_DISPATCH = Counter('ambulance_dispatch_total', 'Ambulance assignment attempts by outcome', ['outcome'])
+DISPATCH_LATENCY = Histogram('ambulance_dispatch_seconds', 'Time to pick and claim the nearest ambulance',
+                             buckets=LATENCY_BUCKETS)
+ADMISSION = Counter('http_admission_total', 'Requests by priority lane and admission outcome', ['lane', 'outcome'])
+ADMISSION_WAIT = Histogram('http_admission_wait_seconds', 'Time requests queued for an admission slot', ['lane'],
+                           buckets=LATENCY_BUCKETS)
+LANE_LATENCY = Histogram('http_lane_duration_seconds', 'Time to produce the response, by priority lane', ['lane'],
+                         buckets=LATENCY_BUCKETS)
+LANE_IN_FLIGHT = Gauge('http_lane_requests_in_flight', 'Admitted requests being handled, by priority lane', ['lane'],
+                       multiprocess_mode='livesum')
+
+
+def multiprocess_enabled():
+    return bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def render():
+    """Return the exposition body and its content type, merged across worker processes."""
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop a finished worker's live gauges; called from gunicorn's child_exit hook."""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
+
+
+def instrument_pool(pool):
+    """Time every ``pool.connect()`` (including pools recreated by ``engine.dispose()``)."""
+    connect, recreate = pool.connect, pool.recreate
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+    pool.recreate = lambda: instrument_pool(recreate())
+    return pool
+
+
+def track_pool_usage(engine):
+    event.listen(engine, 'checkout', lambda *args: POOL_IN_USE.inc())
+    event.listen(engine, 'checkin', lambda *args: POOL_IN_USE.dec())
+
+
+@contextmanager
+def gemini_call(mode, classify):
+    """Time one upstream Gemini call; ``classify(error)`` names the error kind on failure."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        GEMINI_ERRORS.labels(mode=mode, kind=classify(e)).inc()
+        raise
+    finally:
+        GEMINI_LATENCY.labels(mode=mode).observe(time.perf_counter() - started)
@@ -0,0 +1,151 @@
+"""
+Versioned schema migrations for the clinic database.
+
+Each migration runs once, in order, and is recorded in the schema_version table.
+Apply pending migrations with:  flask --app app db-upgrade
+"""
+from datetime import datetime
+
+import sqlalchemy as sa
+
+import directory
+
+version_metadata = sa.MetaData()
+schema_version = sa.Table(
+    'schema_version', version_metadata,
+    sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('description', sa.String(200), nullable=False),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+)
+
+
+def create_missing_indexes(connection, metadata, names):
+    """Create the named model indexes that the database does not have yet."""
+    inspector = sa.inspect(connection)
+    created = []
+    for table in metadata.sorted_tables:
+        wanted = [index for index in table.indexes if index.name in names]
+        if not wanted:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in wanted:
+            if index.name not in existing:
+                index.create(bind=connection)
+                created.append(index.name)
+    return created
+
+
+def add_missing_columns(connection, table, names):
+    """ALTER the named model columns onto an existing table (nullable columns only)."""
+    existing = {column['name'] for column in sa.inspect(connection).get_columns(table.name)}
+    preparer = connection.dialect.identifier_preparer
+    for name in names:
+        if name not in existing:
+            column = table.c[name]
+            connection.execute(sa.text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                f"{column.type.compile(dialect=connection.dialect)}"))
+
+
+def create_tables(connection, metadata):
+    metadata.create_all(bind=connection)
+
+
+HOT_PATH_INDEXES = (
+    'ix_appointment_doctor_status_time',
+    'ix_appointment_patient_status_time',
+    'ix_appointment_hospital_time',
+    'ix_appointment_hospital_status_time',
+    'ix_appointment_status',
+    'ix_appointment_created_at',
+    'ix_appointment_slot_free',
+    'ix_doctor_user_id',
+    'ix_doctor_hospital_id',
+    'ix_doctor_specialization',
+    'ix_doctor_availability_doctor_id',
+    'ix_hospital_admin_id',
+    'ix_emergency_contact_user_id',
+    'ix_ambulance_booking_user_created',
+)
+
+
+def add_hot_path_indexes(connection, metadata):
+    create_missing_indexes(connection, metadata, HOT_PATH_INDEXES)
+
+
+def add_directory_search(connection, metadata):
+    create_tables(connection, metadata)
+    directory.setup_full_text(connection)
+    directory.rebuild(connection, metadata.tables)
+
+
+def add_hospital_coordinates(connection, metadata):
+    # Filled in by the geocode-hospitals command
+    add_missing_columns(connection, metadata.tables['hospital'], ('latitude', 'longitude'))
+
+
+def add_ambulance_fleet(connection, metadata):
+    create_tables(connection, metadata)
+    add_missing_columns(connection, metadata.tables['ambulance_booking'], ('ambulance_id',))
+    create_missing_indexes(connection, metadata, ('ix_ambulance_booking_status_created',))
+
+
+def add_appointment_fee(connection, metadata):
+    add_missing_columns(connection, metadata.tables['appointment'], ('consultation_fee',))
+    # Existing appointments keep the fee their doctor charges today, which is what the rollups counted
+    appointment, doctor = metadata.tables['appointment'], metadata.tables['doctor']
+    connection.execute(appointment.update().where(appointment.c.consultation_fee.is_(None)).values(
+        consultation_fee=sa.select(doctor.c.consultation_fee)
+            .where(doctor.c.id == appointment.c.doctor_id).scalar_subquery()))
+
+
+def rebuild_free_slot_index(connection, metadata):
+    # It used to lead with appointment_id, which a per-doctor range scan can't use
+    current = sa.Table('appointment_slot', sa.MetaData(), autoload_with=connection)
+    for index in current.indexes:
+        if index.name == 'ix_appointment_slot_free' and index.columns.keys()[0] == 'appointment_id':
+            index.drop(bind=connection)
+    create_missing_indexes(connection, metadata, ('ix_appointment_slot_free',))
+
+
+def add_appointment_updated_at(connection, metadata):
+    appointment = metadata.tables['appointment']
+    add_missing_columns(connection, appointment, ('updated_at',))
+    # Unknown for existing rows; their creation time is the best lower bound
+    connection.execute(appointment.update().where(appointment.c.updated_at.is_(None)).values(
+        updated_at=appointment.c.created_at))
+    create_missing_indexes(connection, metadata, ('ix_appointment_updated_at',))
+
+
+MIGRATIONS = [
+    (1, 'Create tables', create_tables),
+    (2, 'Indexes for dashboard, booking and emergency access paths', add_hot_path_indexes),
+    (3, 'Replication heartbeat table', create_tables),
+    (4, 'Hospital and doctor directory with full-text search', add_directory_search),
+    (5, 'Hospital coordinates for nearest-hospital lookups', add_hospital_coordinates),
+    (6, 'Ambulance fleet and dispatch', add_ambulance_fleet),
+    (7, 'Fee charged per appointment', add_appointment_fee),
+    (8, 'Partial free-slot index by doctor and time', rebuild_free_slot_index),
+    (9, 'Appointment change times for incremental exports', add_appointment_updated_at),
+]
+
+
+def current_version(connection):
+    version_metadata.create_all(bind=connection)
+    return connection.execute(sa.select(sa.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine, metadata):
+    """Apply every migration newer than the recorded version. Returns the versions applied."""
+    with engine.begin() as connection:
+        version = current_version(connection)
+    applied = []
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            migrate(connection, metadata)
+            connection.execute(schema_version.insert().values(
+                version=number, description=description, applied_at=datetime.utcnow()))
+        applied.append(number)
+    return applied
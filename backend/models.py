@@ -22,20 +22,29 @@ class User(db.Model):
     appointments = db.relationship('Appointment', backref='patient', lazy=True)
 
 class Hospital(db.Model):
+    __table_args__ = (
+        db.Index('ix_hospital_admin_id', 'admin_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     address = db.Column(db.String(500), nullable=False)
     contact = db.Column(db.String(20))
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     description = db.Column(db.Text)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     doctors = db.relationship('Doctor', backref='hospital', lazy=True)
     appointments = db.relationship('Appointment', backref='hospital', lazy=True)
 
 class Doctor(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_user_id', 'user_id'),
+        db.Index('ix_doctor_hospital_id', 'hospital_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
-    specialization = db.Column(db.String(100), nullable=False)
+    specialization = db.Column(db.String(100), nullable=False, index=True)
     experience = db.Column(db.Integer)
     consultation_fee = db.Column(db.Float, default=50.00)
     about = db.Column(db.Text)
@@ -46,6 +55,9 @@ class Doctor(db.Model):
         return self.user.name if self.user else "Unknown"
 
 class DoctorAvailability(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_availability_doctor_id', 'doctor_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     day_of_week = db.Column(db.Integer, nullable=False)
@@ -53,6 +65,15 @@ class DoctorAvailability(db.Model):
     end_time = db.Column(db.Time, nullable=False)
 
 class Appointment(db.Model):
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_status_time', 'doctor_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_patient_status_time', 'patient_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_hospital_time', 'hospital_id', 'appointment_time'),
+        db.Index('ix_appointment_hospital_status_time', 'hospital_id', 'status', 'appointment_time'),
+        db.Index('ix_appointment_status', 'status'),
+        db.Index('ix_appointment_created_at', 'created_at'),
+        db.Index('ix_appointment_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -68,9 +89,82 @@ class Appointment(db.Model):
     test_results = db.Column(db.Text)
     doctor_notes = db.Column(db.Text)
     completed_at = db.Column(db.DateTime)
+    # The doctor's fee when the appointment was booked; rows without one count at the doctor's current fee
+    consultation_fee = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AppointmentSlot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'slot_time', name='uq_appointment_slot_doctor_time'),
+        # Free slots only, per doctor in time order: what booking pages and /api/slots/next range-scan
+        db.Index('ix_appointment_slot_free', 'doctor_id', 'slot_time',
+                 postgresql_where=db.text('appointment_id IS NULL'), sqlite_where=db.text('appointment_id IS NULL')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    slot_time = db.Column(db.DateTime, nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), unique=True)
+
+class AppointmentRollup(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'doctor_id', 'status', name='uq_appointment_rollup_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+    fee_total = db.Column(db.Float, nullable=False, default=0)
+
+class AppointmentDailyRollup(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'day', 'doctor_id', 'status', name='uq_appointment_daily_rollup_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+    fee_total = db.Column(db.Float, nullable=False, default=0)
+
+class ReplicationHeartbeat(db.Model):
+    """Single row the primary touches so replicas without a native lag query can measure theirs."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class DirectoryEntry(db.Model):
+    """Denormalized search row for one hospital or one doctor, rewritten whenever its sources change.
+
+    No foreign keys: entries are removed after their hospital or doctor, in the same flush.
+    """
+    __table_args__ = (
+        db.Index('ix_directory_entry_kind_name', 'kind', 'name', 'id'),
+        db.Index('ix_directory_entry_kind_specialization_name', 'kind', 'specialization', 'name', 'id'),
+        db.Index('ix_directory_entry_hospital_kind', 'hospital_id', 'kind'),
+        db.Index('ix_directory_entry_doctor_id', 'doctor_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entry_key = db.Column(db.String(20), unique=True, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    hospital_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer)
+    name = db.Column(db.String(200), nullable=False)
+    hospital_name = db.Column(db.String(200))
+    address = db.Column(db.String(500))
+    contact = db.Column(db.String(20))
+    description = db.Column(db.Text)
+    specialization = db.Column(db.String(100))
+    consultation_fee = db.Column(db.Float)
+    experience = db.Column(db.Integer)
+    doctor_count = db.Column(db.Integer)
+    search_text = db.Column(db.Text, nullable=False)
 
 class EmergencyContact(db.Model):
+    __table_args__ = (
+        db.Index('ix_emergency_contact_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -81,7 +175,27 @@ class EmergencyContact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='emergency_contacts')
 
+class Ambulance(db.Model):
+    __table_args__ = (
+        db.Index('ix_ambulance_status', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_number = db.Column(db.String(50), unique=True, nullable=False)
+    driver_name = db.Column(db.String(100))
+    driver_phone = db.Column(db.String(20))
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    status = db.Column(db.String(20), nullable=False, default='available')  # available, dispatched, offline
+    booking_id = db.Column(db.Integer)  # current job while dispatched
+    position_updated_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AmbulanceBooking(db.Model):
+    __table_args__ = (
+        db.Index('ix_ambulance_booking_user_created', 'user_id', 'created_at'),
+        db.Index('ix_ambulance_booking_status_created', 'status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     patient_name = db.Column(db.String(100), nullable=False)
@@ -95,6 +209,7 @@ class AmbulanceBooking(db.Model):
     emergency_type = db.Column(db.String(100))
     patient_condition = db.Column(db.Text)
     status = db.Column(db.String(20), default='requested')
+    ambulance_id = db.Column(db.Integer, db.ForeignKey('ambulance.id'))
     ambulance_number = db.Column(db.String(50))
     driver_name = db.Column(db.String(100))
     driver_phone = db.Column(db.String(20))
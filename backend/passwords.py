@@ -0,0 +1,125 @@
+"""
+Password hashing off the request path.
+
+``PasswordHasher`` hashes with a configurable werkzeug method and cost (``scrypt:32768:8:1``,
+``pbkdf2:sha256:600000``, ...) and runs hashing and verification in a small process pool. At a
+login peak, requests queue for a bounded number of CPU slots (and are turned away with
+``Overloaded`` once the queue is full) instead of each pinning a worker for ~0.1 s of scrypt, and
+under gevent the waiting request no longer blocks every other request on the worker. A login
+whose stored hash was made with other parameters gets a new hash in the same pool call.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from resilience import ConcurrencyLimiter
+
+# Never matches: check_password_hash() rejects anything without a method and salt
+UNUSABLE_PASSWORD = '!'
+
+
+def hash_parameters(pwhash):
+    """The method and cost a hash was made with, e.g. ``scrypt:32768:8:1``."""
+    return pwhash.split('$', 1)[0]
+
+
+def verify_and_update(pwhash, password, method, parameters):
+    """``(valid, new_hash)``: ``new_hash`` is set when the password is right but hashed with other parameters."""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if hash_parameters(pwhash) == parameters:
+        return True, None
+    return True, generate_password_hash(password, method)
+
+
+class PasswordHasher:
+    """Hash and verify passwords in ``workers`` processes (0: in the calling thread)."""
+
+    def __init__(self, method='scrypt', workers=None, max_queue=64, timeout=10.0):
+        self.method = method
+        # Also rejects unknown methods at startup; werkzeug fills in default costs ("scrypt" -> "scrypt:32768:8:1")
+        self.parameters = hash_parameters(generate_password_hash('', method))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.limiter = ConcurrencyLimiter(max_in_flight=self.workers or 1, max_queue=max_queue, timeout=timeout,
+                                          name='password hashing')
+        self.hashed = self.verified = self.rehashed = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        with self._lock:
+            # Started lazily, so each forked worker gets its own processes. They are not forked from
+            # the worker itself, which runs threads (and gevent) by then; as with any multiprocessing
+            # start method but fork, scripts that hash keep their work under `if __name__ == '__main__'`
+            if self._pool is None or self._pid != os.getpid():
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _submit(self, fn, *args):
+        """Run ``fn`` in the pool once a slot is free; the slot is released when it finishes."""
+        self.limiter.acquire()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self.limiter.release()
+            raise
+        future.add_done_callback(lambda _: self.limiter.release())
+        return future
+
+    def _result(self, future):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # A pool process died (e.g. killed for memory); start a fresh pool for the next call
+            with self._lock:
+                self._pool = None
+            raise
+
+    def _call(self, fn, *args):
+        if not self.workers:
+            return self.limiter.run(lambda: fn(*args))
+        return self._result(self._submit(fn, *args))
+
+    def hash(self, password):
+        pwhash = self._call(generate_password_hash, password, self.method)
+        self.hashed += 1
+        return pwhash
+
+    def hash_many(self, passwords):
+        """Hashes of ``passwords`` in order, using the whole pool but competing with logins for its slots."""
+        if not self.workers:
+            return [self.hash(password) for password in passwords]
+        futures = [self._submit(generate_password_hash, password, self.method) for password in passwords]
+        hashes = [self._result(future) for future in futures]
+        self.hashed += len(hashes)
+        return hashes
+
+    def verify_and_update(self, pwhash, password):
+        """``(valid, new_hash)``; store ``new_hash`` when it is set, it uses the configured parameters."""
+        valid, new_hash = self._call(verify_and_update, pwhash, password, self.method, self.parameters)
+        self.verified += 1
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def needs_rehash(self, pwhash):
+        return pwhash != UNUSABLE_PASSWORD and hash_parameters(pwhash) != self.parameters
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+    def stats(self):
+        return {'parameters': self.parameters, 'workers': self.workers, 'waiting': self.limiter.waiting,
+                'rejected': self.limiter.rejected, 'hashed': self.hashed, 'verified': self.verified,
+                'rehashed': self.rehashed}
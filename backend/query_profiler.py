@@ -0,0 +1,145 @@
+"""
+Per-request SQL profiling: query count, database time, the slowest statement and repeated
+statements (the usual sign of an N+1 loop), aggregated per route.
+
+Only a sampled share of requests is profiled in detail; every statement is still timed so
+slow ones are logged whatever the sample.
+"""
+import contextvars
+import random
+import threading
+import time
+
+from sqlalchemy import event
+
+MAX_STATEMENT_CHARS = 300
+MAX_TRACKED_STATEMENTS = 20
+
+
+def shorten(statement):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= MAX_STATEMENT_CHARS else statement[:MAX_STATEMENT_CHARS] + '...'
+
+
+class RequestProfile:
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = {}
+
+    def add(self, statement, elapsed):
+        self.query_count += 1
+        self.db_time += elapsed
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        if elapsed > self.slowest_time:
+            self.slowest_time, self.slowest_statement = elapsed, statement
+
+    def duplicates(self, threshold):
+        """Statements executed at least ``threshold`` times, most repeated first."""
+        repeated = [(count, statement) for statement, count in self.statements.items() if count >= threshold]
+        return sorted(repeated, reverse=True)
+
+    def summary(self, threshold):
+        return {
+            'queries': self.query_count,
+            'db_ms': round(self.db_time * 1000, 2),
+            'slowest_ms': round(self.slowest_time * 1000, 2),
+            'slowest_statement': shorten(self.slowest_statement) if self.slowest_statement else None,
+            'duplicates': [{'count': count, 'statement': shorten(statement)}
+                           for count, statement in self.duplicates(threshold)],
+        }
+
+
+class QueryProfiler:
+    """Collects ``RequestProfile``s from engine events and keeps running totals per route."""
+
+    def __init__(self, sample_rate=0.1, slow_query_ms=200, duplicate_threshold=3):
+        self.sample_rate = sample_rate
+        self.slow_query_ms = slow_query_ms
+        self.duplicate_threshold = duplicate_threshold
+        self._current = contextvars.ContextVar('sql_profile', default=None)
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        elapsed = time.perf_counter() - started
+        profile = self._current.get()
+        if profile is not None:
+            profile.add(statement, elapsed)
+        if elapsed * 1000 >= self.slow_query_ms:
+            print(f"⚠ Slow query ({elapsed * 1000:.1f}ms): {shorten(statement)}")
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start time
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            connection.info['query_started'].pop()
+
+    def start(self, force=False):
+        """Begin profiling the current request if it is sampled. Returns the profile or None."""
+        if not force and random.random() >= self.sample_rate:
+            return None
+        profile = RequestProfile()
+        self._current.set(profile)
+        return profile
+
+    def stop(self):
+        profile = self._current.get()
+        self._current.set(None)
+        return profile
+
+    def record(self, route, profile, elapsed):
+        """Fold a finished request into the per-route totals."""
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {'requests': 0, 'queries': 0, 'db_time': 0.0, 'request_time': 0.0,
+                                              'max_queries': 0, 'slowest_time': 0.0, 'slowest_statement': None,
+                                              'duplicates': {}}
+            stats['requests'] += 1
+            stats['queries'] += profile.query_count
+            stats['db_time'] += profile.db_time
+            stats['request_time'] += elapsed
+            stats['max_queries'] = max(stats['max_queries'], profile.query_count)
+            if profile.slowest_time > stats['slowest_time']:
+                stats['slowest_time'], stats['slowest_statement'] = profile.slowest_time, profile.slowest_statement
+            duplicates = stats['duplicates']
+            for count, statement in profile.duplicates(self.duplicate_threshold):
+                duplicates[statement] = max(duplicates.get(statement, 0), count)
+            if len(duplicates) > MAX_TRACKED_STATEMENTS:
+                keep = sorted(duplicates.items(), key=lambda item: item[1], reverse=True)[:MAX_TRACKED_STATEMENTS]
+                stats['duplicates'] = dict(keep)
+
+    def report(self, limit=20):
+        """Routes ordered by total database time, the biggest offenders first."""
+        with self._lock:
+            rows = [(route, dict(stats, duplicates=dict(stats['duplicates']))) for route, stats in self.routes.items()]
+        rows.sort(key=lambda row: row[1]['db_time'], reverse=True)
+        return [{
+            'route': route,
+            'sampled_requests': stats['requests'],
+            'avg_queries': round(stats['queries'] / stats['requests'], 2),
+            'max_queries': stats['max_queries'],
+            'avg_db_ms': round(stats['db_time'] * 1000 / stats['requests'], 2),
+            'avg_request_ms': round(stats['request_time'] * 1000 / stats['requests'], 2),
+            'total_db_ms': round(stats['db_time'] * 1000, 2),
+            'slowest_ms': round(stats['slowest_time'] * 1000, 2),
+            'slowest_statement': shorten(stats['slowest_statement']) if stats['slowest_statement'] else None,
+            'duplicates': [{'max_count': count, 'statement': shorten(statement)} for statement, count in
+                           sorted(stats['duplicates'].items(), key=lambda item: item[1], reverse=True)],
+        } for route, stats in rows[:limit]]
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
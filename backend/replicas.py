@@ -0,0 +1,131 @@
+"""
+Read-replica routing for read-only pages.
+
+Views marked as replica reads send their SELECTs to a replica whose measured lag is within
+REPLICA_MAX_LAG_SECONDS. Everything else goes to the primary: all writes, reads that follow
+a write in the same request, reads from a user who wrote within the last few seconds
+(read-after-write), and every read while no replica is healthy.
+
+Replication lag is read from the server where it reports it (Postgres recovery replay time,
+MySQL replica status); for other backends, SQLite included, the primary's
+replication_heartbeat row is compared with the copy on the replica.
+"""
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Delete, Insert, Select, Update, text
+
+POSTGRES_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+HEARTBEAT_ID = 1
+
+
+class RoutingSession(Session):
+    """Session that answers plain SELECTs from ``g.replica_engine`` until the session writes."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info['wrote'] = True
+            if has_request_context():
+                g.db_wrote = True
+        elif bind is None and not self.info.get('wrote') and isinstance(clause, Select) and has_request_context():
+            replica = g.get('replica_engine')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def uses_heartbeat(engine):
+    return engine.dialect.name not in ('postgresql', 'mysql')
+
+
+def write_heartbeat(primary, table):
+    with primary.begin() as connection:
+        now = datetime.utcnow()
+        updated = connection.execute(table.update().where(table.c.id == HEARTBEAT_ID).values(beat_at=now))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(id=HEARTBEAT_ID, beat_at=now))
+
+
+def measure_lag(engine, heartbeat_table):
+    """Seconds the replica is behind the primary, or None when it cannot tell."""
+    with engine.connect() as connection:
+        dialect = engine.dialect.name
+        if dialect == 'postgresql':
+            lag = connection.execute(POSTGRES_LAG).scalar()
+            return float(lag) if lag is not None else None
+        if dialect == 'mysql':
+            try:
+                row = connection.execute(text('SHOW REPLICA STATUS')).mappings().first()
+            except Exception:
+                row = connection.execute(text('SHOW SLAVE STATUS')).mappings().first()
+            if row is None:
+                # Not replicating (e.g. a standalone copy): nothing to lag behind
+                return 0.0
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return float(lag) if lag is not None else None
+        beat_at = connection.execute(
+            heartbeat_table.select().with_only_columns(heartbeat_table.c.beat_at)
+            .where(heartbeat_table.c.id == HEARTBEAT_ID)).scalar()
+        return (datetime.utcnow() - beat_at).total_seconds() if beat_at else None
+
+
+class ReplicaRouter:
+    """Tracks each replica's lag and picks a healthy one for a read-only request."""
+
+    def __init__(self, names, max_lag=5.0, check_interval=2.0, sticky_seconds=5.0):
+        self.names = list(names)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.state = {name: {'lag': None, 'error': None, 'checked_at': 0.0} for name in self.names}
+        self.checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def stale(self):
+        return time.monotonic() - self.checked_at >= self.check_interval
+
+    def begin_refresh(self):
+        """True if the caller should run ``refresh`` now (one refresher at a time)."""
+        with self._lock:
+            if self._refreshing or not self.stale():
+                return False
+            self._refreshing = True
+            return True
+
+    def refresh(self, primary, engines, heartbeat_table):
+        try:
+            if any(uses_heartbeat(engine) for engine in engines.values()):
+                write_heartbeat(primary, heartbeat_table)
+            for name in self.names:
+                try:
+                    lag, error = measure_lag(engines[name], heartbeat_table), None
+                except Exception as e:
+                    lag, error = None, str(e)
+                self.state[name] = {'lag': lag, 'error': error, 'checked_at': time.monotonic()}
+        finally:
+            self.checked_at = time.monotonic()
+            self._refreshing = False
+
+    def healthy(self):
+        # A replica whose last check is too old is as unknown as one that failed it
+        horizon = time.monotonic() - 3 * self.check_interval
+        return [name for name, state in self.state.items()
+                if state['lag'] is not None and state['lag'] <= self.max_lag and state['checked_at'] >= horizon]
+
+    def choose(self):
+        healthy = self.healthy()
+        return random.choice(healthy) if healthy else None
+
+    def report(self):
+        now = time.monotonic()
+        return [{'name': name, 'lag_seconds': state['lag'], 'error': state['error'],
+                 'checked_seconds_ago': round(now - state['checked_at'], 1) if state['checked_at'] else None,
+                 'healthy': name in self.healthy()} for name, state in self.state.items()]
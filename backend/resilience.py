@@ -0,0 +1,228 @@
+"""
+Guards for slow or failing upstream services (the Gemini API): a bounded in-flight limit,
+coalescing of identical concurrent calls, and a circuit breaker. Also priority-based admission
+control for incoming requests.
+"""
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Raised when the in-flight limit is reached and the wait queue is full or timed out."""
+
+
+class CircuitOpen(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class ConcurrencyLimiter:
+    """Allow at most ``max_in_flight`` concurrent calls; up to ``max_queue`` callers wait ``timeout`` seconds."""
+
+    def __init__(self, max_in_flight=8, max_queue=32, timeout=5.0, name='the AI service'):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.name = name
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(f'Too many requests waiting for {self.name}')
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(f'Timed out waiting for {self.name}')
+
+    def release(self):
+        self._slots.release()
+
+    def run(self, fn):
+        self.acquire()
+        try:
+            return fn()
+        finally:
+            self.release()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution whose result all callers share."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+            else:
+                self.coalesced += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive failures and fail fast for ``reset_timeout`` seconds.
+
+    Once the timeout passes a single trial call is let through (half-open); its outcome closes
+    or re-opens the circuit. ``is_failure`` decides which exceptions count, so ordinary bad
+    requests do not trip it.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, is_failure=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda error: True)
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go upstream now; pair with record_success/record_failure."""
+        with self._lock:
+            state = self._state()
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise CircuitOpen('AI service temporarily unavailable')
+            if state == 'half-open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self._trial_in_flight = False
+            if not self.is_failure(error):
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """The caller gave up before an outcome (e.g. a client disconnect): free the trial slot only."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def call(self, fn):
+        self.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+
+class PriorityAdmission:
+    """Admit requests by priority lane (``emergency``, ``standard`` or ``low``) into ``capacity`` slots.
+
+    The last ``reserved`` slots only ever go to emergency requests, and low-priority requests hold at
+    most ``low_limit`` slots. A request that finds no free slot queues, higher lanes first: low and
+    standard requests wait up to ``timeout`` seconds with at most ``max_queue`` others and are then
+    shed with Overloaded; emergency requests are never turned away for a full queue and wait up to
+    ``emergency_timeout``.
+    """
+
+    LANES = ('emergency', 'standard', 'low')
+
+    def __init__(self, capacity=32, reserved=4, low_limit=8, max_queue=64, timeout=2.0, emergency_timeout=30.0):
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.low_limit = low_limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.emergency_timeout = emergency_timeout
+        self.in_flight = dict.fromkeys(self.LANES, 0)
+        self.waiting = dict.fromkeys(self.LANES, 0)
+        self.queued = dict.fromkeys(self.LANES, 0)
+        self.shed = dict.fromkeys(self.LANES, 0)
+        self._changed = threading.Condition()
+
+    def _fits(self, lane):
+        busy = sum(self.in_flight.values())
+        if lane == 'emergency':
+            return busy < self.capacity
+        if self.waiting['emergency'] or busy >= self.capacity - self.reserved:
+            return False
+        return lane == 'standard' or (not self.waiting['standard'] and self.in_flight['low'] < self.low_limit)
+
+    def acquire(self, lane):
+        """Take a slot for ``lane``, waiting if needed. Returns True if the request had to queue."""
+        with self._changed:
+            if self._fits(lane):
+                self.in_flight[lane] += 1
+                return False
+            if lane != 'emergency' and self.waiting['standard'] + self.waiting['low'] >= self.max_queue:
+                self.shed[lane] += 1
+                raise Overloaded('Server busy, too many requests waiting')
+            self.waiting[lane] += 1
+            self.queued[lane] += 1
+            try:
+                admitted = self._changed.wait_for(
+                    lambda: self._fits(lane), self.emergency_timeout if lane == 'emergency' else self.timeout)
+            finally:
+                self.waiting[lane] -= 1
+                # Lower lanes may have been held back for this request
+                self._changed.notify_all()
+            if not admitted:
+                self.shed[lane] += 1
+                raise Overloaded('Server busy, timed out waiting for capacity')
+            self.in_flight[lane] += 1
+            return True
+
+    def release(self, lane):
+        with self._changed:
+            self.in_flight[lane] -= 1
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {'capacity': self.capacity, 'reserved': self.reserved, 'low_limit': self.low_limit,
+                    'in_flight': dict(self.in_flight), 'waiting': dict(self.waiting),
+                    'queued': dict(self.queued), 'shed': dict(self.shed)}
@@ -0,0 +1,193 @@
+"""
+Server-side sessions, and a cache of who the logged-in user is.
+
+The session cookie carries only a random id; session data lives in a ``SessionStore``, an
+in-process LRU optionally in front of ``SQLiteStore``, a small SQLite file shared by every worker
+on the host. The same store keeps each logged-in user's identity (the user's id, email, name and
+type plus their doctor and hospital ids), so once it is cached a request knows who is asking and
+what they may do without a database query.
+"""
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+
+from cache import TTLCache
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+PURGE_EVERY = 1000
+
+
+class SQLiteStore:
+    """String values with expiry times in a SQLite file that several processes can share."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # One connection per process: a forked worker must not reuse its parent's
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entry '
+                                     '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        with self._lock:
+            row = self._connect().execute('SELECT value, expires_at FROM entry WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO entry (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, value, time.time() + ttl))
+            self.writes += 1
+            if self.writes % PURGE_EVERY == 0:
+                connection.execute('DELETE FROM entry WHERE expires_at <= ?', (time.time(),))
+
+    def delete(self, key=None, prefix=None):
+        """Drop one key, or every key starting with ``prefix``."""
+        with self._lock:
+            if prefix is not None:
+                self._connect().execute('DELETE FROM entry WHERE key >= ? AND key < ?', (prefix, prefix + '\uffff'))
+            else:
+                self._connect().execute('DELETE FROM entry WHERE key = ?', (key,))
+
+
+class SessionStore:
+    """An LRU of up to ``maxsize`` entries, in front of ``shared`` when one is given.
+
+    With a shared store, entries are kept locally for at most ``local_ttl`` seconds, which bounds
+    how long a change made by another worker (a logout, an updated identity) can go unseen here.
+    """
+
+    def __init__(self, maxsize=10000, shared=None, local_ttl=5):
+        self.shared = shared
+        self.local_ttl = local_ttl if shared is not None else None
+        self.local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, ttl if self.local_ttl is None else min(ttl, self.local_ttl))
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.invalidate(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def delete_prefix(self, prefix):
+        self.local.invalidate_where(lambda key: key.startswith(prefix))
+        if self.shared is not None:
+            self.shared.delete(prefix=prefix)
+
+    def stats(self):
+        return dict(self.local.stats(), shared=self.shared.path if self.shared is not None else None)
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = sid is None
+        # Set by clear(): the next save issues a new id, so an id seen before login is not reused after it
+        self.rotate = False
+
+    def clear(self):
+        super().clear()
+        self.rotate = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps sessions in ``store`` for ``PERMANENT_SESSION_LIFETIME`` after their last change."""
+
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.match(sid):
+            data = self.store.get(f'session:{sid}')
+            if data is not None:
+                return ServerSession(self.serializer.loads(data), sid=sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if not session.new:
+                self.store.delete(f'session:{session.sid}')
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+            return
+        if not session.modified:
+            return
+        issue = session.new or session.rotate
+        if issue:
+            if not session.new:
+                self.store.delete(f'session:{session.sid}')
+            session.sid = secrets.token_urlsafe(32)
+        self.store.set(f'session:{session.sid}', self.serializer.dumps(dict(session)),
+                       app.permanent_session_lifetime.total_seconds())
+        if issue or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session), httponly=httponly,
+                                domain=domain, path=path, secure=secure, samesite=samesite)
+
+
+class IdentityCache:
+    """``get(user_id)`` returns the dict built by ``load(user_id)``, cached in ``store`` for ``ttl`` seconds."""
+
+    def __init__(self, store, load, ttl=300):
+        self.store = store
+        self.load = load
+        self.ttl = ttl
+        self.loads = 0
+
+    def get(self, user_id):
+        cached = self.store.get(f'identity:{user_id}')
+        if cached is not None:
+            return json.loads(cached)
+        identity = self.load(user_id)
+        self.loads += 1
+        if identity is not None:
+            self.store.set(f'identity:{user_id}', json.dumps(identity), self.ttl)
+        return identity
+
+    def forget(self, user_id=None):
+        """Reload one user's identity on next use, or everyone's when ``user_id`` is None."""
+        if user_id is None:
+            self.store.delete_prefix('identity:')
+        else:
+            self.store.delete(f'identity:{user_id}')
@@ -1,6 +1,10 @@
 import pymysql
 import sys
 
+import sqlalchemy as sa
+
+from load_dump import DumpError, load_file
+
 # Database connection details
 host = 'localhost'
 user = 'root'
@@ -26,46 +30,19 @@ try:
     cursor.close()
     connection.close()
     
-    # Now connect to the new database and import schema
-    print(f"\nConnecting to '{database}' database...")
-    connection = pymysql.connect(
-        host=host,
-        user=user,
-        password=password,
-        database=database
-    )
-    
-    cursor = connection.cursor()
-    
-    # Read and execute SQL file
-    print("Importing schema from clinic_db.sql...")
-    with open('clinic_db.sql', 'r', encoding='latin-1') as f:
-        sql_script = f.read()
-    
-    # Split by semicolons and execute each statement
-    statements = sql_script.split(';')
-    for statement in statements:
-        statement = statement.strip()
-        if statement and not statement.startswith('--') and not statement.startswith('/*'):
-            try:
-                cursor.execute(statement)
-            except Exception as e:
-                # Skip errors for comments and empty statements
-                if 'syntax error' not in str(e).lower():
-                    pass
-    
-    connection.commit()
+    # Now load the dump (mysqldump writes it as UTF-16 on Windows) into the new database
+    print(f"\nImporting clinic_db.sql into '{database}'...")
+    engine = sa.create_engine(sa.engine.URL.create(
+        'mysql+pymysql', username=user, password=password, host=host, database=database))
+    load_file(engine, 'clinic_db.sql')
     print("✓ Schema imported successfully!")
     
     # Verify tables
-    cursor.execute("SHOW TABLES")
-    tables = cursor.fetchall()
+    tables = sa.inspect(engine).get_table_names()
     print(f"\n✓ Found {len(tables)} tables:")
     for table in tables:
-        print(f"  - {table[0]}")
-    
-    cursor.close()
-    connection.close()
+        print(f"  - {table}")
+    engine.dispose()
     
     print("\n" + "="*50)
     print("DATABASE SETUP COMPLETE!")
@@ -79,6 +56,9 @@ except pymysql.err.OperationalError as e:
     print("2. Password is correct: Ashok@11042005")
     print("3. User 'root' has proper permissions")
     sys.exit(1)
+except DumpError as e:
+    print(f"\n✗ Import failed: {e}")
+    sys.exit(1)
 except Exception as e:
     print(f"\n✗ Unexpected error: {e}")
     sys.exit(1)